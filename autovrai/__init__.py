@@ -1,28 +1,111 @@
 # this is my hacky way to more easily expose only the limited things I wanted to
 # expose as 'autovrai' to be easily imported by other files
+#
+# nothing is actually imported until it is first used, gradio, torch, and numba each
+# take seconds to import, and most runs only ever need some of them (the CLI help and
+# config validation need none of them). `autovrai.some_function` still works the same,
+# the module it lives in just gets imported the first time it is asked for
 
+import importlib
 
-from .gui import launch_gui
-from .model import model_loader, model_unloader
-from .config import load_schema, load_defaults, handle_argparse, interpret_config
-from .stereo import stereo_eyes, combine_stereo, combine_padded, combine_anaglyph
-from .utilities import (
-    prep_directories,
-    find_filenames,
-    load_image,
-    load_video,
-    determine_file_or_path,
-    suppress_output,
-    colorize_depthmap,
-    save_depthraw,
-    parse_memory_error,
-    get_local_ip,
-    print_current_datetime,
-)
-from .process import (
-    process_image_directory,
-    process_video_directory,
-    process_single_image,
-    process_single_video,
-)
-from .tiles import handle_tiles
+
+EXPORTS = {
+    "gui": ["launch_gui"],
+    "model": [
+        "model_identity",
+        "model_dtype",
+        "model_machine_key",
+        "model_loader",
+        "model_unloader",
+        "model_infer",
+        "cleanup",
+    ],
+    "config": ["load_schema", "load_defaults", "handle_argparse", "interpret_config"],
+    "stereo": [
+        "stereo_eyes",
+        "combine_stereo",
+        "combine_padded",
+        "combine_anaglyph",
+        "stereo_bands",
+        "combine_padded_band",
+        "canvas_eyes",
+        "apply_anaglyph",
+        "warmup_stereo",
+    ],
+    "utilities": [
+        "prep_directories",
+        "find_filenames",
+        "load_image",
+        "read_image_size",
+        "load_video",
+        "get_video_info",
+        "read_video_frames",
+        "find_ffmpeg",
+        "open_video_writer",
+        "write_video_frame",
+        "close_video_writer",
+        "open_image_writer",
+        "write_image_rows",
+        "close_image_writer",
+        "discard_image_writer",
+        "determine_file_or_path",
+        "suppress_output",
+        "colorize_depthmap",
+        "save_depthraw",
+        "load_depthraw",
+        "load_depthmap",
+        "parse_memory_error",
+        "get_local_ip",
+        "print_current_datetime",
+    ],
+    "process": [
+        "process_image_directory",
+        "process_video_directory",
+        "process_single_image",
+        "process_single_video",
+        "run_image_pipeline",
+        "start_stereo_warmup",
+    ],
+    "workers": ["worker_layout", "run_worker_pool"],
+    "farm": ["collect_finished_leases", "run_farm_coordinator", "run_farm_worker"],
+    "tiles": ["handle_tiles"],
+    "debug": ["debug_enabled", "save_debug_image"],
+    "cache": ["depth_cache_key", "load_cached_depth", "save_cached_depth"],
+    "manifest": [
+        "manifest_path",
+        "config_fingerprint",
+        "read_manifest",
+        "compact_manifest",
+        "record_completed",
+        "record_factors",
+    ],
+    "registry": [
+        "registry_directory",
+        "add_registry_paths",
+        "load_registered_model",
+        "register_model",
+        "verify_registered_model",
+    ],
+    "precision": [
+        "factors_store_path",
+        "load_learned_factors",
+        "save_learned_factors",
+    ],
+}
+
+# the reverse lookup, from each exposed name to the module it lives in
+LOCATIONS = {name: module for module, names in EXPORTS.items() for name in names}
+
+
+def __getattr__(name):
+    if name not in LOCATIONS:
+        raise AttributeError(f"module 'autovrai' has no attribute '{name}'")
+
+    # once imported it is kept as a normal attribute, so this only runs the first time
+    value = getattr(importlib.import_module(f".{LOCATIONS[name]}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted([*globals(), *LOCATIONS])
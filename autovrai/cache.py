@@ -0,0 +1,143 @@
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+
+
+# the index of what is in the depth cache is only built once per run by scanning the
+# directory, after that it's kept up to date as files are added, used, and evicted. it
+# maps each cached file path to a (last used, size in bytes) pair
+INDEX = None
+LOCK = threading.Lock()
+
+
+def depth_cache_limit(config):
+    # the size is given in GB, zero (the default) means the cache is turned off
+    return int(config.get("depth-cache-size", 0) * 2**30)
+
+
+def depth_cache_key(config, filename):
+    if depth_cache_limit(config) <= 0:
+        return None
+
+    # only the settings that change the depth information itself are part of the key,
+    # anything about the stereo or the outputs can change without missing the cache
+    settings = {
+        "model-name": config["model-name"].lower(),
+        "model-dtype": config.get("model-dtype", "fp32"),
+        "precision-width": config.get("precision-width"),
+        "precision-height": config.get("precision-height"),
+        "precision-factor": config.get("precision-factor"),
+        "tiled-upscale": bool(config.get("tiled-upscale")),
+    }
+
+    # only part of the key when it's used, so the keys of everything else don't change
+    if config.get("tiled-upscale") and config.get("tile-blur", "exact") != "exact":
+        settings["tile-blur"] = config["tile-blur"]
+
+    # the image is keyed by its actual content, so renaming or moving it doesn't matter
+    digest = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(2**20), b""):
+            digest.update(chunk)
+    digest.update(json.dumps(settings, sort_keys=True).encode())
+
+    return digest.hexdigest()
+
+
+def depth_cache_path(config, key):
+    directory = os.path.join(config.get("cache-directory", "cache"), "depth")
+    return os.path.join(directory, key[:2], f"{key}.npz")
+
+
+def load_cached_depth(config, key, factor):
+    # `factor` is the precision factor the depth would be generated at right now. the
+    # key only has the requested one, and dynamic mode can end up lower than that, so
+    # an entry made at a lower factor than what fits now is treated as a miss and gets
+    # replaced instead of handing back the lower precision depth forever
+    if key is None:
+        return None
+
+    path = depth_cache_path(config, key)
+    if not os.path.exists(path):
+        return None
+
+    # with process-workers another process can evict the entry at any point in here
+    try:
+        with np.load(path) as cached:
+            if "factor" not in cached.files or cached["factor"] + 1e-9 < factor:
+                return None
+            quantized = cached["depth"]
+            low = cached["low"]
+            high = cached["high"]
+
+        # marks the entry as recently used, the eviction goes by these times
+        with LOCK:
+            index = scan_depth_cache(config)
+            os.utime(path)
+            index[path] = (os.path.getmtime(path), os.path.getsize(path))
+    except FileNotFoundError:
+        return None
+
+    return (low + (quantized / 65535.0) * (high - low)).astype(np.float32)
+
+
+def save_cached_depth(config, key, depth, factor):
+    # `factor` is the precision factor the depth was actually generated at
+    if key is None:
+        return
+
+    path = depth_cache_path(config, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # stored as 16-bit values spread across the depth's own range, this is a quarter
+    # of the size of the float64 depth from the tiled upscale and is far more precise
+    # than float16 would be for the values that it produces
+    low = depth.min()
+    high = depth.max()
+    scale = 65535.0 / (high - low) if high > low else 0.0
+    quantized = np.round((depth - low) * scale).astype(np.uint16)
+
+    # written to a temporary file first so a crash can't leave a broken cache entry,
+    # named per process and thread since the process-workers share the same cache
+    temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporary, "wb") as f:
+        np.savez(f, depth=quantized, low=low, high=high, factor=factor)
+    os.replace(temporary, path)
+
+    with LOCK:
+        index = scan_depth_cache(config)
+        index[path] = (os.path.getmtime(path), os.path.getsize(path))
+        evict_depth_cache(config, index)
+
+
+def scan_depth_cache(config):
+    global INDEX
+    if INDEX is None:
+        INDEX = {}
+        directory = os.path.join(config.get("cache-directory", "cache"), "depth")
+        for root, _, files in os.walk(directory):
+            for file in files:
+                if file.endswith(".npz"):
+                    path = os.path.join(root, file)
+                    INDEX[path] = (os.path.getmtime(path), os.path.getsize(path))
+    return INDEX
+
+
+def evict_depth_cache(config, index):
+    # least recently used entries are removed first until we are back under the limit
+    limit = depth_cache_limit(config)
+    total = sum(size for _, size in index.values())
+    if total <= limit:
+        return
+
+    for path in sorted(index, key=lambda path: index[path][0]):
+        if total <= limit:
+            break
+        total -= index.pop(path)[1]
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # already removed by another process
+            pass
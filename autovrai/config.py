@@ -122,11 +122,14 @@ def handle_argparse(schema, defaults):
             default_info = ""
 
         # bring it all together and add the argument to the parser
+        # booleans default to None instead of False so they only override the config
+        # when they are actually given, otherwise they'd always turn the option off
         if prop_type == "boolean":
             parser.add_argument(
                 f"--{prop}",
                 help=f"{details['description']}{default_info}",
                 action="store_true",
+                default=None,
             )
         else:
             parser.add_argument(
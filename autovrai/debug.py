@@ -0,0 +1,45 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+# the debug images are encoded and written on their own threads, so turning them on
+# doesn't hold up the processing. only so many can be waiting at once though, past
+# that we wait on the oldest ones instead of holding on to every image in memory. the
+# threads are joined when python exits, so nothing still waiting is ever lost
+SAVERS = None
+PENDING = threading.BoundedSemaphore(16)
+LOCK = threading.Lock()
+
+
+def debug_enabled(config):
+    return bool(config.get("debug-directory"))
+
+
+def save_debug_image(config, name, filename, create):
+    # `create` builds the PIL image from the data, it's called on the saving thread so
+    # the conversions don't happen on the main loop either. the data it uses must not
+    # be changed afterwards, it's still being read after this returns
+    if not debug_enabled(config):
+        return
+
+    global SAVERS
+    with LOCK:
+        if SAVERS is None:
+            SAVERS = ThreadPoolExecutor(2, thread_name_prefix="autovrai-debug")
+
+    # every input gets its own directory so the images of one never overwrite another
+    path = os.path.join(config["debug-directory"], name, filename)
+
+    PENDING.acquire()
+    future = SAVERS.submit(write_debug_image, path, create)
+    future.add_done_callback(lambda _: PENDING.release())
+
+
+def write_debug_image(path, create):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        create().save(path)
+    except Exception as e:
+        # a debug image is never worth failing the actual outputs over
+        print("--- AutoVR.ai ---", f"Failed to save the debug image {path}: {e}")
@@ -0,0 +1,346 @@
+import os
+import json
+import time
+import socket
+import threading
+
+import autovrai
+
+
+# how often the coordinator looks for finished and abandoned leases, and how often an
+# idle worker looks for new ones
+FARM_POLL = 1.0
+
+# the farm is just a directory that every machine can see. each lease is a json file
+# that moves from pending to leased (claimed with a rename, which only one worker can
+# win) and the worker writes a matching record into done once it's finished with it
+FARM_FOLDERS = ["pending", "leased", "done"]
+
+
+def farm_path(config, *parts):
+    return os.path.join(config.get("farm-directory", "farm"), *parts)
+
+
+def write_farm_file(path, data):
+    # written to a temporary file first so nobody ever reads half of a file, every
+    # process has its own temporary name since they all share the same directory
+    temporary = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    with open(temporary, "w") as f:
+        json.dump(data, f)
+    os.replace(temporary, path)
+
+
+def read_farm_file(path):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def lease_id(filename):
+    # lease files are named "<id>.json" while pending and "<id>.<worker>.json" while
+    # leased, the worker name can have dots of its own so only the first one counts
+    return filename.split(".", 1)[0]
+
+
+def is_stale(seen, path, timeout):
+    # a heartbeat is a worker touching the file, we only ever compare its modified time
+    # against what it was the last time we looked, so the clocks of the machines
+    # involved never need to agree with each other
+    try:
+        modified = os.path.getmtime(path)
+    except FileNotFoundError:
+        seen.pop(path, None)
+        return False
+
+    now = time.monotonic()
+    if path not in seen or seen[path][0] != modified:
+        seen[path] = (modified, now)
+        return False
+    return now - seen[path][1] > timeout
+
+
+def create_leases(config, batches):
+    # a lease holds a few batches at a time so a library with hundreds of thousands of
+    # images doesn't turn into hundreds of thousands of tiny files to scan through
+    size = config.get("farm-lease-images", 32)
+    leases = []
+    current = []
+    for batch in batches:
+        current.append([os.path.basename(filename) for filename in batch])
+        if sum(len(batch) for batch in current) >= size:
+            leases.append(current)
+            current = []
+    if current:
+        leases.append(current)
+
+    for folder in FARM_FOLDERS:
+        os.makedirs(farm_path(config, folder), exist_ok=True)
+        for filename in os.listdir(farm_path(config, folder)):
+            os.remove(farm_path(config, folder, filename))
+
+    for index, lease in enumerate(leases):
+        write_farm_file(farm_path(config, "pending", f"{index:08d}.json"), lease)
+
+    return len(leases)
+
+
+def collect_finished_leases(config, manifest):
+    # the state of an earlier coordinator is taken down first, a worker that starts
+    # before the new one is up would otherwise read that it already finished and
+    # leave. it waits for the new state to show up instead
+    state = farm_path(config, "farm.json")
+    farm = read_farm_file(state)
+    try:
+        os.remove(state)
+    except FileNotFoundError:
+        pass
+
+    # leases that were finished after the earlier coordinator last looked (or after
+    # it stopped) would otherwise be thrown away with the rest of its farm, so they
+    # go into the manifest the same way they would have if it had seen them
+    folder = farm_path(config, "done")
+    if farm is None or not os.path.isdir(folder):
+        return 0
+
+    count = 0
+    for filename in sorted(os.listdir(folder)):
+        record = None
+        if filename.endswith(".json"):
+            record = read_farm_file(os.path.join(folder, filename))
+        if record is None:
+            continue
+
+        for filepath in record["files"]:
+            autovrai.record_completed(manifest, filepath, farm["fingerprint"])
+        if record["factors"]:
+            autovrai.record_factors(manifest, record["factors"])
+        count += len(record["files"])
+
+    if count:
+        print(
+            "--- AutoVR.ai ---",
+            f"Recorded {count} images finished for an earlier coordinator.",
+        )
+    return count
+
+
+def run_farm_coordinator(config, batches, factors, manifest, fingerprint, report):
+    timeout = config.get("farm-lease-timeout", 120)
+    state = farm_path(config, "farm.json")
+    os.makedirs(farm_path(config), exist_ok=True)
+
+    # anything left over from an earlier run is replaced, the manifest is what keeps
+    # track of the finished files between runs. every run gets its own id, so the
+    # workers can tell this run apart from an earlier one that already finished
+    total = create_leases(config, batches)
+    run = f"{socket.gethostname()}-{os.getpid()}-{int(time.time())}"
+    write_farm_file(
+        state,
+        {"run": run, "fingerprint": fingerprint, "factors": factors, "finished": False},
+    )
+    print(
+        "--- AutoVR.ai ---",
+        f"Coordinating {total} leases in {farm_path(config)}, waiting on workers...",
+    )
+
+    factors = dict(factors)
+    finished = set()
+    seen = {}
+    while len(finished) < total:
+        time.sleep(FARM_POLL)
+
+        # the workers watch this file the same way we watch their leases, so they can
+        # tell when we've stopped
+        os.utime(state)
+
+        for filename in sorted(os.listdir(farm_path(config, "done"))):
+            identifier = lease_id(filename)
+            if identifier in finished or not filename.endswith(".json"):
+                continue
+            record = read_farm_file(farm_path(config, "done", filename))
+            if record is None:
+                continue
+
+            finished.add(identifier)
+            for filepath in record["files"]:
+                autovrai.record_completed(manifest, filepath, fingerprint)
+                report(filepath)
+            if record["factors"] != factors:
+                factors.update(record["factors"])
+                autovrai.record_factors(manifest, factors)
+
+        # a worker that stopped sending heartbeats has crashed or lost its connection,
+        # its leases go back to pending for someone else to pick up
+        for filename in os.listdir(farm_path(config, "leased")):
+            path = farm_path(config, "leased", filename)
+            identifier = lease_id(filename)
+            if identifier in finished:
+                # a lease that was handed back out after it was already finished
+                remove_lease(path)
+            elif is_stale(seen, path, timeout):
+                print(
+                    "--- AutoVR.ai ---",
+                    f"Lease {identifier} timed out, handing it back out.",
+                )
+                return_lease(config, path, identifier)
+
+    write_farm_file(state, {"run": run, "fingerprint": fingerprint, "finished": True})
+    return factors
+
+
+def return_lease(config, path, identifier):
+    try:
+        os.rename(path, farm_path(config, "pending", f"{identifier}.json"))
+    except FileNotFoundError:
+        # finished (or handed back by the worker itself) while we were looking
+        pass
+
+
+def remove_lease(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def claim_lease(config, worker):
+    for filename in sorted(os.listdir(farm_path(config, "pending"))):
+        if not filename.endswith(".json"):
+            continue
+        identifier = lease_id(filename)
+        path = farm_path(config, "leased", f"{identifier}.{worker}.json")
+        try:
+            os.rename(farm_path(config, "pending", filename), path)
+        except FileNotFoundError:
+            # another worker got to it first
+            continue
+
+        # the rename keeps the old modified time, the heartbeat starts from right now
+        os.utime(path)
+        return identifier, path, read_farm_file(path)
+    return None
+
+
+def run_farm_worker(config):
+    worker = f"{socket.gethostname().replace('.', '-')}-{os.getpid()}"
+    timeout = config.get("farm-lease-timeout", 120)
+    state = farm_path(config, "farm.json")
+    print("--- AutoVR.ai ---", f"Farm worker {worker} watching {farm_path(config)}")
+
+    # the leases this worker is holding, and which of their files are still to go
+    active = {}
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def heartbeat():
+        while not stop.wait(timeout / 4):
+            with lock:
+                paths = [path for path, _, _ in active.values()]
+            for path in paths:
+                try:
+                    os.utime(path)
+                except FileNotFoundError:
+                    print("--- AutoVR.ai ---", f"Lost the lease on {path}")
+
+    def leased_batches():
+        while True:
+            claimed = claim_lease(config, worker)
+            if claimed is None:
+                return
+
+            identifier, path, lease = claimed
+            files = [filepath for batch in lease for filepath in batch]
+            with lock:
+                for filepath in files:
+                    owners[filepath] = identifier
+                active[identifier] = (path, set(files), files)
+            for batch in lease:
+                yield [os.path.join(config["input-source"], f) for f in batch]
+
+    def report(filepath):
+        with lock:
+            identifier = owners.pop(filepath)
+            path, remaining, files = active[identifier]
+            remaining.discard(filepath)
+            if remaining:
+                return
+            del active[identifier]
+
+        # the lease is taken out of leased with a rename before anything is recorded,
+        # if the coordinator handed it back out because our heartbeats were late the
+        # rename fails and whoever has it now is the one who records it as done
+        finishing = farm_path(config, "done", f"{identifier}.{worker}.tmp")
+        try:
+            os.rename(path, finishing)
+        except FileNotFoundError:
+            print(
+                "--- AutoVR.ai ---",
+                f"Lost the lease {identifier} before it was finished, "
+                "leaving it to the worker that has it now.",
+            )
+            return
+
+        record = {"worker": worker, "files": files, "factors": factors}
+        write_farm_file(farm_path(config, "done", f"{identifier}.json"), record)
+        remove_lease(finishing)
+        print("--- AutoVR.ai ---", f"Finished lease {identifier} ({len(files)} images)")
+
+    owners = {}
+    factors = None
+    model = None
+    seen = {}
+    first = True
+    previous = None
+    threading.Thread(target=heartbeat, daemon=True).start()
+    autovrai.start_stereo_warmup()
+
+    try:
+        while True:
+            farm = read_farm_file(state)
+            if farm is not None and farm.get("finished"):
+                # a run that had already finished when this worker started is left
+                # over from before, the worker waits for the next coordinator instead
+                if first:
+                    previous = farm.get("run")
+                    print("--- AutoVR.ai ---", "Waiting for the coordinator to start.")
+                if first or farm.get("run") == previous:
+                    first = False
+                    time.sleep(FARM_POLL)
+                    continue
+                break
+            first = False
+            if farm is None or is_stale(seen, state, timeout):
+                if farm is not None:
+                    print("--- AutoVR.ai ---", "The coordinator stopped responding.")
+                    break
+                time.sleep(FARM_POLL)
+                continue
+
+            if factors is None:
+                factors = dict(farm.get("factors", {}))
+                if farm["fingerprint"] != autovrai.config_fingerprint(config):
+                    print(
+                        "--- AutoVR.ai ---",
+                        "WARNING: this worker's config doesn't match the coordinator's, "
+                        "its outputs may not match the rest.",
+                    )
+
+            # the pipeline runs until there's nothing left to claim, which also lets it
+            # finish up the outputs of the last leases it has. the model stays loaded
+            # between runs, so waiting around for more leases costs nothing
+            model = autovrai.run_image_pipeline(
+                config, leased_batches(), factors, None, None, report
+            )
+            time.sleep(FARM_POLL)
+    finally:
+        stop.set()
+
+        # anything we still hold goes straight back to pending instead of waiting
+        # for the coordinator to notice that the heartbeats stopped
+        for identifier, (path, _, _) in active.items():
+            return_lease(config, path, identifier)
+        autovrai.model_unloader(model)
+
+    return f"Done. Farm worker {worker} finished."
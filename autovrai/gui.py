@@ -150,6 +150,9 @@ def gui_layout():
                 model_name = component("model-name")
             with gr.Column():
                 device_name = component("device-name")
+                model_dtype = component("model-dtype")
+                model_compile = component("model-compile")
+                batch_size = component("batch-size")
 
     with gr.Accordion("Precision", open=False) as precision:
         with gr.Row(variant="panel"):
@@ -177,8 +180,8 @@ def gui_layout():
                 input_type = component("input-type", interactive=False)
                 input_patterns = component("input-patterns", interactive=False)
             with gr.Column():
-                input_depthmap = component("input-depthmap", interactive=False)
-                input_depthraw = component("input-depthraw", interactive=False)
+                input_depthmap = component("input-depthmap")
+                input_depthraw = component("input-depthraw")
 
     with gr.Accordion("Outputs", open=False) as outputs:
         with gr.Row(variant="panel"):
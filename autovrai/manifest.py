@@ -0,0 +1,109 @@
+import os
+import json
+import hashlib
+import threading
+
+
+# the manifest is appended to from the writer threads, one line per completed file
+LOCK = threading.Lock()
+
+# these only change how (or how fast) the work gets done, not what the outputs are, so
+# changing them between runs shouldn't make the completed files look out of date
+FINGERPRINT_IGNORED = [
+    "$schema",
+    "model-directory",
+    "model-compile",
+    "device-name",
+    "precision-mode",
+    "batch-size",
+    "tile-batch-size",
+    "stereo-band-rows",
+    "pipeline-workers",
+    "process-workers",
+    "worker-devices",
+    "worker-threads",
+    "farm-role",
+    "farm-directory",
+    "farm-lease-images",
+    "farm-lease-timeout",
+    "input-source",
+    "input-patterns",
+    "cache-directory",
+    "depth-cache-size",
+    "debug-directory",
+    "resume",
+    "factors",
+]
+
+
+def manifest_path(config):
+    # the manifest lives alongside the first output that is turned on, it's a dot file
+    # so it won't get picked up by input-patterns if the outputs are used as inputs
+    for key in [
+        "output-stereo",
+        "output-padded",
+        "output-anaglyph",
+        "output-depthmap",
+        "output-depthraw",
+    ]:
+        if config.get(key):
+            return os.path.join(config[key], ".autovrai-manifest.jsonl")
+    return None
+
+
+def config_fingerprint(config):
+    settings = {k: v for k, v in config.items() if k not in FINGERPRINT_IGNORED}
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+
+def read_manifest(path):
+    # the manifest is a journal with one json record per line where the last record
+    # for a file wins. a half written line from a crash is simply skipped
+    completed = {}
+    factors = {}
+    if path is None or not os.path.exists(path):
+        return completed, factors
+
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "file" in record:
+                completed[record["file"]] = record["fingerprint"]
+            if "factors" in record:
+                factors.update(record["factors"])
+
+    return completed, factors
+
+
+def compact_manifest(path):
+    # rewrites the journal down to one line per file so it doesn't grow forever
+    if path is None or not os.path.exists(path):
+        return
+
+    completed, factors = read_manifest(path)
+    with LOCK:
+        with open(f"{path}.tmp", "w") as f:
+            f.write(json.dumps({"factors": factors}) + "\n")
+            for file, fingerprint in completed.items():
+                f.write(json.dumps({"file": file, "fingerprint": fingerprint}) + "\n")
+        os.replace(f"{path}.tmp", path)
+
+
+def record_completed(path, filepath, fingerprint):
+    append_record(path, {"file": filepath, "fingerprint": fingerprint})
+
+
+def record_factors(path, factors):
+    append_record(path, {"factors": factors})
+
+
+def append_record(path, record):
+    if path is None:
+        return
+
+    with LOCK:
+        with open(path, "a") as f:
+            f.write(json.dumps(record) + "\n")
@@ -1,6 +1,8 @@
 import gc
+import os
 import torch
 import warnings
+from torchvision import transforms
 
 import autovrai
 
@@ -19,9 +21,14 @@ NAME = None
 DEVICE = None
 WIDTH = None
 HEIGHT = None
+DTYPE = None
 
+# anything other than fp32 runs the model with autocast, the weights themselves always
+# stay in fp32 so switching between these never needs the model to be reloaded
+DTYPES = {"fp32": torch.float32, "fp16": torch.float16, "bf16": torch.bfloat16}
 
-def model_loader(config, base_width: int, base_height: int, factor: float):
+
+def model_identity(config):
     device_name = config["device-name"].lower()
     device_name = "cuda" if device_name == "gpu" else device_name
 
@@ -36,25 +43,96 @@ def model_loader(config, base_width: int, base_height: int, factor: float):
     else:
         raise ValueError("Invalid model name")
 
-    # used to tell the model what "precision" to operate at, in a prior version the
-    # approach was to set the model resizer's width and height before processing each
-    # image, but found that there were memory leaks related to that approach. now the
-    # model is built once, and the resizer is set once, so the model needs to be
-    # unloaded and reloaded if the precision to process at changes. note, the height
-    # and width look swapped here because of how the model uses this internally
+    return model_name, device_name
+
+
+def model_dtype(config):
+    dtype = config.get("model-dtype", "fp32").lower()
+    if dtype not in DTYPES:
+        raise ValueError("Invalid model dtype (fp32, fp16, or bf16)")
+    return dtype
+
+
+def model_machine_key(config):
+    # identifies the model running on this specific kind of device with this amount
+    # of memory, which is what decides the precision factors that will actually fit
+    model_name, device_name = model_identity(config)
+    dtype = model_dtype(config)
+
+    if device_name.startswith("cuda") and torch.cuda.is_available():
+        properties = torch.cuda.get_device_properties(torch.device(device_name))
+        hardware = properties.name
+        memory = properties.total_memory
+    else:
+        hardware = "cpu"
+        memory = system_memory()
+
+    key = f"{model_name} {dtype} {device_name} {hardware}"
+    if memory is None:
+        # without knowing how much memory there is, every machine of this kind shares
+        # the same factors, it's still better than not remembering them at all
+        return key
+    return f"{key} {round(memory / 2**30)}GB"
+
+
+def system_memory():
+    # the total physical memory in bytes, or None if there's no way to tell. sysconf
+    # only exists on unix like systems, psutil (if it's installed) works everywhere
+    if hasattr(os, "sysconf"):
+        try:
+            return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+        except (ValueError, OSError):
+            pass
+
+    try:
+        import psutil
+
+        return psutil.virtual_memory().total
+    except ImportError:
+        return None
+
+
+def model_loader(config, base_width: int, base_height: int, factor: float):
+    model_name, device_name = model_identity(config)
+    dtype = model_dtype(config)
+
+    # used to tell the model what "precision" to operate at. note, the height and
+    # width look swapped here because of how the model uses this internally
     width = int(round(base_width * factor))
     height = int(round(base_height * factor))
     img_size = [height, width]
 
-    # if the model is already loaded, and the details are the same, just return it
-    global MODEL, NAME, DEVICE, WIDTH, HEIGHT
+    # if the model is already loaded, and the details are the same, just return it. the
+    # weights are the only expensive part to load, so as long as it is the same model
+    # it only gets moved to the other device and the resizer is changed as needed
+    global MODEL, NAME, DEVICE, WIDTH, HEIGHT, DTYPE
     if MODEL is not None:
-        if (
-            NAME == model_name
-            and DEVICE == device_name
-            and WIDTH == width
-            and HEIGHT == height
-        ):
+        if NAME == model_name:
+            if DTYPE != dtype:
+                print("--- AutoVR.ai ---", f"Switching to (model-dtype: {dtype})")
+                model_memory_format(MODEL, dtype)
+                DTYPE = dtype
+            if DEVICE != device_name:
+                print(
+                    "--- AutoVR.ai ---",
+                    f"Moving (model-name: {model_name}) onto "
+                    f"(device-name: {device_name}) without reloading the model",
+                )
+                MODEL.to(device_name)
+                clear_position_caches(MODEL)
+                cleanup()
+                DEVICE = device_name
+            if WIDTH != width or HEIGHT != height:
+                print(
+                    "--- AutoVR.ai ---",
+                    f"Changing the precision to (width: {width}) and "
+                    f"(height: {height}) without reloading the model",
+                )
+                model_resize(MODEL, width, height)
+                WIDTH = width
+                HEIGHT = height
+                cleanup()
+            model_compile(MODEL, config)
             return MODEL
         else:
             MODEL = model_unloader(MODEL)
@@ -75,29 +153,120 @@ def model_loader(config, base_width: int, base_height: int, factor: float):
         f"and (factor: {factor})",
     )
 
-    # we will print out our own model information instead
+    # the local model registry is always tried first, only a model that hasn't been
+    # registered yet is loaded from torch hub, and then it gets registered for next time
     with autovrai.suppress_output():
-        MODEL = torch.hub.load(
-            "isl-org/ZoeDepth",
-            model_name,
-            pretrained=True,
-            img_size=img_size,
+        MODEL = autovrai.load_registered_model(config, model_name, img_size)
+
+    if MODEL is None:
+        print(
+            "--- AutoVR.ai ---",
+            f"Did not find (model-name: {model_name}) in the model registry, "
+            "loading it from torch hub...",
         )
-        MODEL.to(device_name)
-        MODEL.eval()
+        # we will print out our own model information instead
+        with autovrai.suppress_output():
+            MODEL = torch.hub.load(
+                "isl-org/ZoeDepth",
+                model_name,
+                pretrained=True,
+                img_size=img_size,
+            )
+        autovrai.register_model(config, model_name, MODEL)
+
+    MODEL.to(device_name)
+    MODEL.eval()
+    model_memory_format(MODEL, dtype)
+    model_compile(MODEL, config)
 
     NAME = model_name
     DEVICE = device_name
     WIDTH = width
     HEIGHT = height
+    DTYPE = dtype
 
     cleanup()
     autovrai.print_current_datetime("After model loaded")
     return MODEL
 
 
+def model_resize(model, width: int, height: int):
+    # in a prior version the resizer's width and height were changed before each
+    # image, but that leaked memory. the leak was the BEiT backbone caching a relative
+    # position index for every input size it has seen, which gets huge at the higher
+    # precisions, so those caches are cleared out every time the size is changed
+    resizer = model.core.prep.resizer
+    resizer._Resize__width = width
+    resizer._Resize__height = height
+
+    clear_position_caches(model)
+
+
+def clear_position_caches(model):
+    # these are plain dictionaries of tensors, so they don't follow the model when it
+    # is moved to another device and would otherwise keep every size ever used around
+    for module in model.modules():
+        if isinstance(getattr(module, "relative_position_indices", None), dict):
+            module.relative_position_indices.clear()
+
+
+def model_memory_format(model, dtype):
+    # the reduced precisions also use the channels-last layout, which is what their
+    # faster convolution kernels expect. ZoeDepth overrides `to` with a version that
+    # only takes a device, so the regular torch version is called directly here
+    memory_format = torch.contiguous_format if dtype == "fp32" else torch.channels_last
+    torch.nn.Module.to(model, memory_format=memory_format)
+
+
+def model_compile(model, config):
+    # the compiled forward pass replaces the regular one on this instance only, so
+    # turning it back off is just a matter of removing it again
+    enabled = bool(config.get("model-compile"))
+    compiled = "forward" in model.__dict__
+    if enabled == compiled:
+        return
+    elif not enabled:
+        del model.forward
+        return
+
+    print("--- AutoVR.ai ---", "Compiling the model, the first image will be slow...")
+
+    # the compiled graphs are kept on disk next to the learned precision factors, so
+    # every run after the first one for a given input size skips most of the work.
+    # these are read when torch first compiles something, so they are set before that
+    directory = os.path.join(config.get("cache-directory", "cache"), "compiled")
+    os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", os.path.abspath(directory))
+    os.environ.setdefault("TORCHINDUCTOR_FX_GRAPH_CACHE", "1")
+
+    # each input size gets its own static graph, every size of image that shows up
+    # is another graph, so the default limit of 8 of them would be hit quickly
+    torch._dynamo.config.cache_size_limit = max(
+        torch._dynamo.config.cache_size_limit, 64
+    )
+    model.forward = torch.compile(model.forward, dynamic=False)
+
+
+@torch.inference_mode()
+def model_infer(model, images):
+    # same as the model's own `infer_pil`, but stacks every image into a single tensor
+    # so the whole batch goes through one forward pass. the images must all be the
+    # exact same size for this to work, the results are split back out per image
+    x = torch.stack([transforms.ToTensor()(image) for image in images])
+    x = x.to(model.device)
+
+    # fp32 runs exactly as it always has, the others run with autocast. the depths
+    # always come back out as float32, which is what everything after this expects
+    device_type = torch.device(model.device).type
+    with torch.autocast(device_type, DTYPES[DTYPE], enabled=DTYPE != "fp32"):
+        if DTYPE != "fp32":
+            x = x.contiguous(memory_format=torch.channels_last)
+        depths = model.infer(x, pad_input=True, with_flip_aug=True)
+
+    return [depth.squeeze().float().cpu().numpy() for depth in depths]
+
+
 def model_unloader(model):
-    global MODEL, NAME, DEVICE, WIDTH, HEIGHT
+    global MODEL, NAME, DEVICE, WIDTH, HEIGHT, DTYPE
 
     del model
     del MODEL
@@ -107,6 +276,7 @@ def model_unloader(model):
     DEVICE = None
     WIDTH = None
     HEIGHT = None
+    DTYPE = None
 
     cleanup()
     return None
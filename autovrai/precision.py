@@ -0,0 +1,100 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+import autovrai
+
+
+# the learned factors are shared by every run on this machine, so the store is always
+# read fresh and rewritten as a whole to pick up anything another run has added
+LOCK = threading.Lock()
+
+# writing the store only ever takes a moment, a lock file older than this was left
+# behind by a process that died while holding it
+STORE_LOCK_TIMEOUT = 10.0
+
+
+def factors_store_path(config):
+    return os.path.join(config.get("cache-directory", "cache"), "factors.json")
+
+
+def read_factors_store(path):
+    if not os.path.exists(path):
+        return {}
+
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (json.JSONDecodeError, OSError):
+        # a broken store only costs us having to learn the factors over again
+        return {}
+
+
+@contextmanager
+def store_lock(path):
+    # the threading lock only covers this process, but the workers of a worker pool
+    # (and any other run on this machine) write the same store at the same time. the
+    # lock file covers them, creating it with O_EXCL only ever succeeds for one of us
+    lock = f"{path}.lock"
+    with LOCK:
+        while True:
+            try:
+                os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                break
+            except FileExistsError:
+                pass
+
+            try:
+                if time.time() - os.path.getmtime(lock) > STORE_LOCK_TIMEOUT:
+                    # renamed out of the way first so only one of us gets to take it
+                    stale = f"{lock}.{os.getpid()}.{threading.get_ident()}.stale"
+                    os.rename(lock, stale)
+                    os.remove(stale)
+            except FileNotFoundError:
+                pass
+            time.sleep(0.01)
+
+        try:
+            yield
+        finally:
+            os.remove(lock)
+
+
+def load_learned_factors(config):
+    # the factors that fit are specific to the model, the device, and how much memory
+    # the device has, so a store copied over from another machine is just ignored
+    machine = autovrai.model_machine_key(config)
+    factors = read_factors_store(factors_store_path(config)).get(machine, {})
+
+    if factors:
+        print(
+            "--- AutoVR.ai ---",
+            f"Loaded {len(factors)} learned precision factors for ({machine})",
+        )
+    return factors
+
+
+def save_learned_factors(config, factors, requested):
+    # only the factors that had to be lowered from where they started are worth
+    # keeping, those are the ones that took an out of memory error to find out
+    learned = {k: v for k, v in factors.items() if v < requested}
+    if not learned:
+        return
+
+    path = factors_store_path(config)
+    machine = autovrai.model_machine_key(config)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with store_lock(path):
+        store = read_factors_store(path)
+        if all(store.get(machine, {}).get(k) == v for k, v in learned.items()):
+            return
+        store.setdefault(machine, {}).update(learned)
+
+        # written to a temporary file first so nobody ever reads half of the store
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, "w") as f:
+            json.dump(store, f, indent=4, sort_keys=True)
+        os.replace(temporary, path)
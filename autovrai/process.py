@@ -1,27 +1,172 @@
 import os
+import math
 import tqdm
-from PIL import Image
+import threading
+import itertools
+import collections
+import numpy as np
+from PIL import Image, ImageColor
 from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
 
 
 import autovrai
 
 
-def process_single_video(config, video):
+STEREO_LOCK = threading.Lock()
+
+# the precision factors that dynamic mode will try are all multiples of this
+FACTOR_STEP = 0.05
+
+OUTPUT_KEYS = [
+    "output-stereo",
+    "output-padded",
+    "output-anaglyph",
+    "output-depthmap",
+    "output-depthraw",
+]
+
+
+def process_single_video(config, video, progress=None):
+    # the output videos keep the same filename as the source, each enabled output gets
+    # its own encoder and the frames are streamed straight into them from memory
+    filepath = os.path.basename(video)
+
+    capture = autovrai.load_video(video)
+    info = autovrai.get_video_info(capture)
+
+    precision = determine_precision_info(config)
+    factors = config.get("factors", {})
+
+    if config.get("output-depthraw"):
+        print(
+            "--- AutoVR.ai ---",
+            "Skipping output-depthraw, it is not supported for videos yet.",
+        )
+
     print(
-        "This will be implemented soon in another version, but for now you can use the "
-        "video shredder and video stitcher from the scripts directory."
+        "--- AutoVR.ai ---",
+        f"Processing {info.count} frames at {info.fps} fps from {filepath}",
     )
-    pass
 
+    # this is the model that will be used to process the frames, but it needs
+    # reloaded if the precision changes or if we hit an out of memory error
+    model = None
+    writers = {}
 
-def process_video_directory(config):
+    if progress != None:
+        progress(0.0, desc="Starting...")
+
+    # frames of a video are all the same size, so they can be batched as they come
+    batch_sizes = {}
+    batch_size = config.get("batch-size", 1)
+
+    failed = True
+    try:
+        frames = autovrai.read_video_frames(capture)
+        with tqdm.tqdm(total=info.count) as bar:
+            while True:
+                images = list(itertools.islice(frames, batch_size))
+                if not images:
+                    break
+
+                if progress != None and model == None:
+                    progress(0, desc="Loading model, just a moment...")
+
+                # the frames are named by their number, for the debug images
+                names = [
+                    f"{os.path.splitext(filepath)[0]}_{bar.n + i:06d}"
+                    for i in range(len(images))
+                ]
+                model, depths = generate_depths(
+                    config, model, images, precision, factors, batch_sizes, names
+                )
+
+                for image, depth in zip(images, depths):
+                    left, right = generate_stereo(config, image, depth)
+                    outputs = build_image_outputs(config, image, depth, left, right)
+
+                    # encoders are opened lazily so they can use the real output sizes
+                    for key, frame in outputs.items():
+                        if key not in writers:
+                            writers[key] = autovrai.open_video_writer(
+                                os.path.join(config[key], filepath),
+                                frame.width,
+                                frame.height,
+                                info.fps,
+                                audio_source=video,
+                            )
+                        autovrai.write_video_frame(writers[key], frame)
+
+                    bar.update(1)
+                    if progress != None:
+                        progress(
+                            bar.n / max(bar.total, 1),
+                            desc=f"Processed frame of {filepath}",
+                        )
+        failed = False
+    finally:
+        capture.release()
+        close_video_writers(writers, failed)
+
+    # remember what worked so the next video (and the next run) starts at the right
+    # precision instead of working its way back down from out of memory errors
+    config["factors"] = factors
+    persist_factors(config, precision, factors)
+
+    return model
+
+
+def close_video_writers(writers, failed):
+    # every encoder gets closed even if one of them fails. when we're already on our
+    # way out because of an error, that error is the one worth seeing, an encoder that
+    # can't close because of it (like ffmpeg having exited on a broken pipe) is only
+    # printed instead of hiding it
+    error = None
+    for writer in writers.values():
+        try:
+            autovrai.close_video_writer(writer)
+        except (OSError, RuntimeError) as e:
+            if failed:
+                print("--- AutoVR.ai ---", f"Could not close a video encoder: {e}")
+            error = error or e
+
+    if error is not None and not failed:
+        raise error
+
+
+def process_video_directory(config, progress=None):
     autovrai.prep_directories(config)
+    autovrai.add_registry_paths(config)
+    start_stereo_warmup()
+
+    filenames = autovrai.find_filenames(
+        config["input-source"], config["input-patterns"]
+    )
+    file_count = filenames.__len__()
+
+    precision = determine_precision_info(config)
+    config["factors"] = preload_factors(config, precision)
+    print("--- AutoVR.ai ---", precision)
+    print("--- AutoVR.ai ---", "Using factors:", config.get("factors", {}))
+
+    model = None
+    for i in range(file_count):
+        print("--- AutoVR.ai ---", f"Video {i + 1} of {file_count}: {filenames[i]}")
+        model = process_single_video(config, filenames[i], progress)
+
     print(
-        "This will be implemented soon in another version, but for now you can use the "
-        "video shredder and video stitcher from the scripts directory."
+        "--- AutoVR.ai ---",
+        f"Processed {file_count} videos. "
+        f"The final precision factor settings used: {config.get('factors', {})}",
     )
-    pass
+
+    # we are done with the model, go ahead and unload it to free up memory. when
+    # nothing needed it, it was never loaded (and torch never imported)
+    if model is not None:
+        model = autovrai.model_unloader(model)
+
+    return f"Done. Processed {file_count} videos."
 
 
 def process_single_image(config, image):
@@ -34,167 +179,582 @@ def process_single_image(config, image):
 
 def process_image_directory(config, progress=None):
     autovrai.prep_directories(config)
+    autovrai.add_registry_paths(config)
+
+    # a farm worker gets its images from the coordinator instead of the input-source
+    if config.get("farm-role", "none") == "worker":
+        return autovrai.run_farm_worker(config)
 
     filenames = autovrai.find_filenames(
         config["input-source"], config["input-patterns"]
     )
-    file_count = filenames.__len__()
 
     precision = determine_precision_info(config)
     print("--- AutoVR.ai ---", precision)
 
-    factors = config.get("factors", {})
+    factors = preload_factors(config, precision)
+
+    # the manifest records every completed file, so an interrupted run can be picked
+    # back up where it left off with the resume option. it also keeps the factors that
+    # were learned so the resumed run starts out at the right precision
+    manifest = autovrai.manifest_path(config)
+    fingerprint = autovrai.config_fingerprint(config)
+    if config.get("farm-role", "none") == "coordinator":
+        autovrai.collect_finished_leases(config, manifest)
+    autovrai.compact_manifest(manifest)
+    if config.get("resume"):
+        completed, saved_factors = autovrai.read_manifest(manifest)
+        factors = {**saved_factors, **factors}
+
+        remaining = [
+            filename
+            for filename in filenames
+            if not is_completed(config, filename, completed, fingerprint)
+        ]
+        print(
+            "--- AutoVR.ai ---",
+            f"Resuming, skipping {len(filenames) - len(remaining)} images that are "
+            "already complete and current.",
+        )
+        filenames = remaining
+
+    file_count = filenames.__len__()
     print("--- AutoVR.ai ---", "Using factors:", factors)
 
+    # images of the same resolution are grouped together to be batched by the model
+    batches = group_filenames(filenames, config.get("batch-size", 1))
+
+    if progress != None:
+        progress(0.0, desc="Starting...")
+
+    with tqdm.tqdm(total=file_count) as bar:
+
+        def report(filepath):
+            bar.update(1)
+            if progress != None:
+                progress(bar.n / bar.total, desc=f"Processed {filepath}")
+
+        # either everything runs right here, or the batches are handed out to farm
+        # workers or a pool of worker processes that each run this same pipeline with
+        # their own model
+        if config.get("farm-role", "none") == "coordinator":
+            factors = autovrai.run_farm_coordinator(
+                config, batches, factors, manifest, fingerprint, report
+            )
+        elif config.get("process-workers", 0) > 0:
+            factors = autovrai.run_worker_pool(
+                config, batches, factors, manifest, fingerprint, report
+            )
+        else:
+            start_stereo_warmup()
+            model = run_image_pipeline(
+                config, batches, factors, manifest, fingerprint, report, progress
+            )
+
+            # we are done with the model, go ahead and unload it to free up memory. when
+            # nothing needed it, it was never loaded (and torch never imported)
+            if model is not None:
+                model = autovrai.model_unloader(model)
+
+    print(
+        "--- AutoVR.ai ---",
+        f"Processed {file_count} images. "
+        f"The final precision factor settings used: {factors}",
+    )
+
+    return f"Done. Processed {file_count} images."
+
+
+def run_image_pipeline(
+    config, batches, factors, manifest, fingerprint, report, progress=None
+):
+    precision = determine_precision_info(config)
+    recorded_factors = dict(factors)
+
     # this is the model that will be used to process the images, but it needs
     # reloaded if the precision changes or if we hit an out of memory error
     model = None
+    batch_sizes = {}
+
+    # the work is split into stages so the model never sits waiting on PIL: a pool of
+    # threads decodes the upcoming batches, the model runs here on the main thread, and
+    # another pool handles the stereo shift and the output encodes. both queues are
+    # bounded so we don't get too far ahead and hold too many images in memory. the
+    # batches can be any iterable, a worker process pulls them from a shared queue
+    workers = config.get("pipeline-workers", 2)
+    loaders = ThreadPoolExecutor(workers) if workers > 0 else None
+    writers = ThreadPoolExecutor(workers) if workers > 0 else None
+    loading = collections.deque()
+    writing = collections.deque()
+    batches = iter(batches)
+
+    try:
+        while True:
+            # keep the decode queue topped up with the next few batches
+            while len(loading) <= workers:
+                batch = next(batches, None)
+                if batch is None:
+                    break
+                loading.append(
+                    (
+                        batch,
+                        run_stage(
+                            loaders, load_images, config, batch, precision, factors
+                        ),
+                    )
+                )
+
+            if not loading:
+                break
+
+            # load the actual images from the files, along with any cached depths
+            batch, future = loading.popleft()
+            images, depths, cache_keys = future.result()
+
+            # only the images that don't have a depth yet need to go to the model
+            missing = [i for i in range(len(images)) if depths[i] is None]
+            if missing:
+                if progress != None and model == None:
+                    progress(0, desc="Loading model, just a moment...")
+
+                model, generated = generate_depths(
+                    config,
+                    model,
+                    [images[i] for i in missing],
+                    precision,
+                    factors,
+                    batch_sizes,
+                    [os.path.splitext(os.path.basename(batch[i]))[0] for i in missing],
+                )
+                for i, depth in zip(missing, generated):
+                    depths[i] = depth
+
+                if factors != recorded_factors:
+                    autovrai.record_factors(manifest, factors)
+                    persist_factors(config, precision, factors)
+                    recorded_factors = dict(factors)
+
+            for i in range(len(batch)):
+                filepath = os.path.basename(batch[i])
+                future = run_stage(
+                    writers,
+                    finish_image,
+                    config,
+                    images[i],
+                    depths[i],
+                    filepath,
+                    cache_keys[i],
+                    manifest,
+                    fingerprint,
+                    precision_settings(precision, images[i], factors).factor,
+                )
+                writing.append((filepath, future))
+
+            collect_finished(writing, 2 * workers, report)
+
+        collect_finished(writing, 0, report)
+    finally:
+        # anything still waiting to be decoded can be dropped, but the outputs of
+        # images that already made it through the model are still worth finishing
+        if loaders is not None:
+            loaders.shutdown(wait=True, cancel_futures=True)
+        if writers is not None:
+            writers.shutdown(wait=True)
+
+    return model
+
+
+def start_stereo_warmup():
+    # the stereo kernels get ready in the background while the model is loading, so
+    # the first image doesn't have to wait on them.
+    #
+    # the stereo module (and numba with it) is imported right here on the calling
+    # thread though. with numba's tbb threading layer, getting it set up from inside
+    # a daemon thread leaves the interpreter hanging at exit
+    warmup_stereo = autovrai.warmup_stereo
+
+    def warmup():
+        with STEREO_LOCK:
+            warmup_stereo()
+
+    threading.Thread(target=warmup, daemon=True).start()
+
+
+def run_stage(pool, function, *args):
+    # without a pool the work happens right away, but it still hands back a future so
+    # the rest of the pipeline doesn't need to care which way it was run
+    if pool is None:
+        future = Future()
+        future.set_result(function(*args))
+        return future
+    return pool.submit(function, *args)
+
+
+def collect_finished(pending, limit, report):
+    # results are collected strictly in the order they were submitted, only blocking on
+    # the oldest one once there are more than `limit` of them still in flight
+    while pending and (len(pending) > limit or pending[0][1].done()):
+        filepath, future = pending.popleft()
+        future.result()
+        report(filepath)
+
+
+def load_images(config, filenames, precision, factors):
+    images = [autovrai.load_image(filename) for filename in filenames]
+
+    # PIL only decodes the pixel data the first time it is used, force that to happen
+    # now so it is done on the loader thread instead of holding up the model
+    for image in images:
+        image.load()
+
+    # look for a depth that was provided as an input or already generated with the same
+    # settings (and at least the factor it would be generated at now), the cache key is
+    # kept for the ones that weren't found so they can be cached once they're generated
+    depths = []
+    cache_keys = []
+    for filename, image in zip(filenames, images):
+        key = None
+        depth = load_input_depth(config, filename, image)
+        if depth is None:
+            key = autovrai.depth_cache_key(config, filename)
+            factor = precision_settings(precision, image, factors).factor
+            depth = autovrai.load_cached_depth(config, key, factor)
+        depths.append(depth)
+        cache_keys.append(key if depth is None else None)
+
+    return images, depths, cache_keys
+
+
+def load_input_depth(config, filename, image):
+    # the input depth files are named the same way the outputs are saved, so the output
+    # directories of an earlier run can be used directly as the inputs of a new one
+    png_file = depth_filename(os.path.basename(filename))
+
+    depth = None
+    if config.get("input-depthraw"):
+        depthraw = os.path.join(config["input-depthraw"], png_file)
+        if os.path.exists(depthraw):
+            depth = autovrai.load_depthraw(depthraw)
+    if depth is None and config.get("input-depthmap"):
+        depthmap = os.path.join(config["input-depthmap"], png_file)
+        if os.path.exists(depthmap):
+            depth = autovrai.load_depthmap(depthmap)
+
+    # stereo needs the depth to line up with the image pixel for pixel
+    if depth is not None and depth.shape != (image.height, image.width):
+        resized = Image.fromarray(depth).resize(image.size, Image.BILINEAR)
+        depth = np.array(resized, dtype=np.float32)
+
+    return depth
+
+
+def finish_image(
+    config,
+    image,
+    depth,
+    filepath,
+    cache_key=None,
+    manifest=None,
+    fingerprint=None,
+    factor=None,
+):
+    # the depth is cached along with the factor it was actually generated at
+    autovrai.save_cached_depth(config, cache_key, depth, factor)
+
+    if config.get("stereo-band-rows", 0) > 0:
+        # very large images are shifted and saved a band of rows at a time instead
+        save_banded_outputs(config, image, depth, filepath)
+    else:
+        # generate the stereo images and save the outputs based on the output locations
+        # defined in the config
+        save_image_outputs(config, image, depth, filepath)
 
-    if progress != None:
-        current = 0.0
-        portion = 1.0 / file_count
-        progress(current, desc="Starting...")
-
-    for i in tqdm.trange(file_count):
-        filename = filenames[i]
-        filepath = os.path.basename(filename)
-
-        # load the actual image from the file
-        image = autovrai.load_image(filename)
-        depth = None
-
-        # determine the initial precision settings to use
-        if precision.type == "pixels":
-            width = precision.width
-            height = precision.height
-            factor = 1.0
-        elif precision.type == "factor":
-            width = image.width
-            height = image.height
-            factor = precision.factor
-        else:
-            raise ValueError("Invalid precision type (factor or pixels)")
+    # only recorded once every output has been saved
+    autovrai.record_completed(manifest, filepath, fingerprint)
 
-        # track if the current run worked functions as the key to the factors
-        # dictionary to track what factors worked
-        success = False
-        dimensions = str((width, height))
 
-        # check if we have a known factor to use for this width and height combination
-        if dimensions in factors:
-            factor = factors[dimensions]
+def is_completed(config, filename, completed, fingerprint):
+    # a file only counts as done if it was finished with the same settings and every
+    # output it should have is actually still there
+    filepath = os.path.basename(filename)
+    if completed.get(filepath) != fingerprint:
+        return False
 
-        if progress != None and model == None:
-            progress(0, desc="Loading model, just a moment...")
+    for key in OUTPUT_KEYS:
+        if config.get(key):
+            if not os.path.exists(output_filename(config, key, filepath)):
+                return False
 
-        # generate the actual depth info either with a manual precision mode that will
-        # fail if we run out of VRAM, or dynamically where the precision used will be
-        # reduced automatically if an error is encountered
-        if precision.mode == "manual":
-            model = autovrai.model_loader(config, width, height, factor)
-            depth = model.infer_pil(image, output_type="numpy")
-            success = True
-        elif precision.mode == "dynamic":
-            # attempt to generate a depth map, but reduce the factor and retry if needed
-            while not success and factor > 0:
-                try:
-                    model = autovrai.model_loader(config, width, height, factor)
-                    depth = model.infer_pil(image, output_type="numpy")
-                    success = True
-                except RuntimeError as e:
-                    if "out of memory" in str(e) or "can't allocate memory" in str(e):
-                        print(
-                            "--- AutoVR.ai ---",
-                            f"Error encountered while using "
-                            f"(width: {width}), "
-                            f"(height: {height}), "
-                            f"and (factor: {factor}). "
-                            "Retrying with a lower factor...",
-                        )
-                        print(
-                            "--- AutoVR.ai ---",
-                            "Memory Error (in GB): ",
-                            autovrai.parse_memory_error(str(e)),
-                        )
-                        del depth
-                        depth = None
-                        model = autovrai.model_unloader(model)
-                        factor = round(factor - 0.1, 1)
-                    else:
-                        raise e
-        else:
-            raise ValueError("Invalid precision mode (dynamic or manual)")
+    return True
+
+
+def preload_factors(config, precision):
+    # the factors learned on earlier runs are only used in dynamic mode, in manual
+    # mode the precision asked for is exactly the precision that gets used
+    factors = config.get("factors", {})
+    if precision.mode == "dynamic":
+        factors = {**autovrai.load_learned_factors(config), **factors}
+    return factors
 
-        # once the depth information has been generated, save the final factor used
-        if success:
-            factors[dimensions] = factor
+
+def persist_factors(config, precision, factors):
+    if precision.mode != "dynamic":
+        return
+
+    requested = precision.factor if precision.type == "factor" else 1.0
+    autovrai.save_learned_factors(config, factors, requested)
+
+
+def precision_settings(precision, image, factors):
+    # determine the initial precision settings to use
+    if precision.type == "pixels":
+        width = precision.width
+        height = precision.height
+        factor = 1.0
+    elif precision.type == "factor":
+        width = image.width
+        height = image.height
+        factor = precision.factor
+    else:
+        raise ValueError("Invalid precision type (factor or pixels)")
+
+    # the dimensions function as the key to the factors and batch_sizes dictionaries
+    # to track what factors and batch sizes worked
+    dimensions = str((width, height))
+
+    # check if we have a known factor to use for this width and height combination,
+    # a learned factor can only ever lower the precision from what was asked for
+    if dimensions in factors:
+        factor = min(factor, factors[dimensions])
+
+    Settings = namedtuple("Settings", ["width", "height", "factor", "dimensions"])
+    return Settings(width, height, factor, dimensions)
+
+
+def generate_depths(config, model, images, precision, factors, batch_sizes, names):
+    # every image passed in here must be the exact same size, they get batched together
+    width, height, factor, dimensions = precision_settings(
+        precision, images[0], factors
+    )
+
+    # same thing for the batch size, it only ever goes down from the configured one
+    batch_size = batch_sizes.get(dimensions, config.get("batch-size", 1))
+
+    if precision.mode not in ["manual", "dynamic"]:
+        raise ValueError("Invalid precision mode (dynamic or manual)")
+
+    # generate the actual depth info either with a manual precision mode that will
+    # fail if we run out of VRAM, or dynamically where the precision used will be
+    # reduced automatically if an error is encountered. either way, the batch size is
+    # reduced first, and only once we are down to a single image is the factor touched
+    #
+    # the factor is found with a search, `low` is the highest factor known to work and
+    # `high` is the lowest one known to fail. the first guess comes from the numbers in
+    # the memory error and after that it bisects, a lower factor that worked is kept as
+    # the fallback while checking if something in between the two will still fit
+    low = 0.0
+    high = None
+    fallback = None
+    probes = 0
+
+    depths = []
+    while len(depths) < len(images):
+        batch = images[len(depths) : len(depths) + batch_size]
+        try:
+            model = autovrai.model_loader(config, width, height, factor)
+            generated = autovrai.model_infer(model, batch)
+        except RuntimeError as e:
+            if "out of memory" not in str(e) and "can't allocate memory" not in str(e):
+                raise e
+
+            info = autovrai.parse_memory_error(str(e))
+            print(
+                "--- AutoVR.ai ---",
+                f"Error encountered while using "
+                f"(width: {width}), "
+                f"(height: {height}), "
+                f"(factor: {factor}), "
+                f"and (batch-size: {batch_size}).",
+            )
+            print("--- AutoVR.ai ---", "Memory Error (in GB): ", info)
+            autovrai.cleanup()
+
+            if batch_size > 1:
+                print("--- AutoVR.ai ---", "Retrying with a smaller batch size...")
+                batch_size = batch_size // 2
+                continue
+            elif precision.mode != "dynamic":
+                raise e
+
+            probes += 1
+            high = factor
+            if factor <= low:
+                low = 0.0
+                fallback = None
+
+            # the attempted amount in the error is only the one allocation that failed,
+            # not everything the rest of the run still needed, so the estimate always
+            # lands just under the factor that failed. it's only good for a first guess
+            estimate = estimate_factor(high, info) if probes == 1 else None
+            factor = next_factor_probe(low, high, estimate)
+            if factor is not None:
+                print("--- AutoVR.ai ---", f"Retrying with (factor: {factor})...")
+                continue
+            elif fallback is None:
+                raise RuntimeError(
+                    "Failed to generate depth map even after reducing factor to "
+                    f"{high}."
+                )
+
+            # nothing left in between, so go with the last factor that worked
+            factor = low
+            generated = fallback
         else:
-            raise RuntimeError(
-                "Failed to generate depth map even after reducing factor to zero."
+            if high is not None:
+                probes += 1
+                low = factor
+                fallback = generated
+
+                probe = next_factor_probe(low, high)
+                if probe is not None:
+                    print(
+                        "--- AutoVR.ai ---",
+                        f"Succeeded with (factor: {factor}), "
+                        f"checking if (factor: {probe}) also fits...",
+                    )
+                    factor = probe
+                    continue
+
+        if high is not None:
+            print(
+                "--- AutoVR.ai ---",
+                f"Settled on (factor: {factor}) for {dimensions} "
+                f"after {probes} probes.",
+            )
+            high = None
+            fallback = None
+            probes = 0
+
+        depths.extend(generated)
+
+    # once the depth information has been generated, save the final settings used
+    factors[dimensions] = factor
+    batch_sizes[dimensions] = batch_size
+
+    # the tiles are sized relative to the resolution the whole image was run at
+    if config.get("tiled-upscale"):
+        resolution = (width * factor, height * factor)
+        for i in range(len(images)):
+            depths[i] = autovrai.handle_tiles(
+                config, images[i], depths[i], resolution, names[i]
             )
 
-        if config["tiled-upscale"]:
-            depth = autovrai.handle_tiles(model, image, depth)
+    return model, depths
 
-        # generate the stereo images for the left and right eyes
-        left, right = autovrai.stereo_eyes(image, depth, config["stereo-intensity"])
 
-        # swap the left and right images if we're using "combine" --- !!!TEMPORARY!!!
-        if config["tiled-upscale"]:
-            temp = left
-            left = right
-            right = temp
+def estimate_factor(factor, info):
+    # the memory needed grows with the number of pixels, so with the square of the
+    # factor. when it failed at least what was allocated plus the attempted amount was
+    # needed, and what was allocated plus whatever was still free is what was available
+    allocated = info.get("allocated", 0.0)
+    needed = allocated + info.get("attempted", 0.0)
+    available = allocated + info.get("free", 0.0)
+    if needed <= 0 or available <= 0:
+        return None
+    return factor * math.sqrt(available / needed)
 
-        # save the outputs based on the output locations defined in the config
-        save_image_outputs(config, image, depth, left, right, filepath)
 
-        if progress != None:
-            current += portion
-            progress(current, desc=f"Processed {filepath}")
+def next_factor_probe(low, high, estimate=None):
+    # factors are kept on a grid of FACTOR_STEP, this returns the one to try next that
+    # is strictly in between `low` and `high`, or None if there aren't any left
+    first = math.floor(low / FACTOR_STEP + 1e-9) + 1
+    last = math.ceil(high / FACTOR_STEP - 1e-9) - 1
+    if first > last:
+        return None
 
-    print(
-        "--- AutoVR.ai ---",
-        f"Processed {file_count} images. "
-        f"The final precision factor settings used: {factors}",
-    )
+    # the estimate is only trusted when it lands in between, otherwise just bisect
+    target = estimate if estimate and low < estimate < high else (low + high) / 2
+    step = min(max(math.floor(target / FACTOR_STEP + 1e-9), first), last)
+    return round(step * FACTOR_STEP, 2)
 
-    # we are done with the model, go ahead and unload it to free up memory
-    model = autovrai.model_unloader(model)
 
-    return f"Done. Processed {file_count} images."
+def group_filenames(filenames, batch_size):
+    # batches can only contain images of the exact same size, and changing the size
+    # the model runs at isn't free either, so all the files are grouped by resolution
+    # first (in the order each resolution first shows up) and then split into batches
+    buckets = {}
+    for filename in filenames:
+        size = autovrai.read_image_size(filename)
+        buckets.setdefault(size, []).append(filename)
+
+    batches = []
+    for bucket in buckets.values():
+        for i in range(0, len(bucket), batch_size):
+            batches.append(bucket[i : i + batch_size])
+    return batches
+
+
+def stereo_intensity(config):
+    intensity = config["stereo-intensity"]
+
+    # swap the left and right images if we're using "combine" --- !!!TEMPORARY!!!
+    # flipping the sign of the divergence is the same as swapping the finished eyes,
+    # but keeps them in order as the two halves of the same side by side buffer
+    if config.get("tiled-upscale"):
+        intensity = -intensity
+
+    return intensity
+
 
+def generate_stereo(config, image, depth):
+    intensity = stereo_intensity(config)
+
+    # generate the stereo images for the left and right eyes. the default numba
+    # threading layer can't run parallel kernels from more than one thread at a time,
+    # so only one image at a time goes through here even with the pipeline workers
+    with STEREO_LOCK:
+        left, right = autovrai.stereo_eyes(image, depth, intensity)
+
+    return left, right
+
+
+def build_image_outputs(config, image, depth, left, right):
+    # builds every enabled output image in memory, keyed by its output config name, so
+    # the same results can be saved as individual files or streamed into a video
+    outputs = {}
 
-def save_image_outputs(config, image, depth, left, right, filepath):
     if config.get("output-stereo"):
-        stereo = autovrai.combine_stereo(left, right)
-        stereo.save(os.path.join(config["output-stereo"], filepath))
+        outputs["output-stereo"] = autovrai.combine_stereo(left, right)
 
     if config.get("output-padded"):
-        padding = determine_padding_info(config)
-        if padding.type == "pixels":
-            padded = autovrai.combine_padded(
-                left,
-                right,
-                padded.width,
-                padded.height,
-                padded.color,
-            )
-        elif padding.type == "factor":
-            padded = autovrai.combine_padded(
-                left,
-                right,
-                int(round(image.width * padded.factor)),
-                int(round(image.height * padded.factor)),
-                padded.color,
-            )
-        else:
-            raise ValueError("Invalid padded type (factor or pixels)")
-        padded.save(os.path.join(config["output-padded"], filepath))
+        width, height = padded_size(config, image)
+        outputs["output-padded"] = autovrai.combine_padded(
+            left, right, width, height, config.get("padded-color")
+        )
 
     if config.get("output-anaglyph"):
-        anaglyph = autovrai.combine_anaglyph(left, right)
-        anaglyph.save(os.path.join(config["output-anaglyph"], filepath))
+        outputs["output-anaglyph"] = autovrai.combine_anaglyph(left, right)
 
+    if config.get("output-depthmap"):
+        outputs["output-depthmap"] = Image.fromarray(autovrai.colorize_depthmap(depth))
+
+    return outputs
+
+
+def padded_size(config, image):
+    padding = determine_padding_info(config)
+    if padding.type == "pixels":
+        return padding.width, padding.height
+    elif padding.type == "factor":
+        return (
+            int(round(image.width * padding.factor)),
+            int(round(image.height * padding.factor)),
+        )
+    else:
+        raise ValueError("Invalid padded type (factor or pixels)")
+
+
+def depth_filename(filepath):
     # make a filename for the depthmap and depthraw outputs, be sure it is a png
     png_file = filepath
     name, ext = os.path.splitext(filepath)
@@ -202,13 +762,198 @@ def save_image_outputs(config, image, depth, left, right, filepath):
         # we are just adding .png instead of replacing the extension, this is to prevent
         # ending up with more than one input file trying to use the same output filename
         png_file = filepath + ".png"
+    return png_file
+
+
+def output_filename(config, key, filepath):
+    # the depth outputs are always saved as pngs, the rest keep the input's filename
+    if key in ["output-depthmap", "output-depthraw"]:
+        return os.path.join(config[key], depth_filename(filepath))
+    return os.path.join(config[key], filepath)
 
+
+def save_image_outputs(config, image, depth, filepath):
+    # every output gets a single canvas that it is saved straight from. the stereo
+    # kernel writes the eyes directly into the first canvas they fit in, the other
+    # outputs only get a copy of them (or the anaglyph made from them), nothing is
+    # converted or pasted around in between. each of those is saved as soon as it is
+    # filled in, so there are never more than two canvases around at once
+    channels = len(image.getbands())
+    sizes = {}
+    if config.get("output-stereo"):
+        sizes["output-stereo"] = (image.width, image.height)
+    if config.get("output-padded"):
+        sizes["output-padded"] = padded_size(config, image)
+    primary = next(
+        (
+            key
+            for key, (width, height) in sizes.items()
+            if image.width <= width and image.height <= height
+        ),
+        None,
+    )
+
+    writers = {}
+    try:
+        # without a canvas to put them in the eyes get a buffer of their own
+        left, right = None, None
+        if primary is not None:
+            writers[primary] = open_output_canvas(
+                config, primary, filepath, *sizes[primary], channels
+            )
+            left, right = autovrai.canvas_eyes(
+                writers[primary]["canvas"],
+                *sizes[primary],
+                image.width,
+                image.height,
+                channels,
+            )
+
+        if config.get("output-anaglyph"):
+            writers["output-anaglyph"] = autovrai.open_image_writer(
+                output_filename(config, "output-anaglyph", filepath),
+                image.width,
+                image.height,
+                canvas=True,
+            )
+
+        with STEREO_LOCK:
+            left, right = autovrai.stereo_eyes(
+                image, depth, stereo_intensity(config), left=left, right=right
+            )
+            if "output-anaglyph" in writers:
+                anaglyph = writers["output-anaglyph"]["canvas"]
+                autovrai.apply_anaglyph(left, right, anaglyph[:, :, :3])
+                del anaglyph
+
+        if "output-anaglyph" in writers:
+            autovrai.close_image_writer(writers.pop("output-anaglyph"))
+
+        for key, (width, height) in sizes.items():
+            if key == primary:
+                continue
+            writers[key] = open_output_canvas(
+                config, key, filepath, width, height, channels
+            )
+            canvas = writers[key]["canvas"]
+            eyes = autovrai.canvas_eyes(
+                canvas, width, height, image.width, image.height, channels
+            )
+            if eyes is None:
+                # a padded size smaller than the image, the eyes get clipped
+                canvas[:, :, :3] = autovrai.combine_padded_band(
+                    left,
+                    right,
+                    0,
+                    image.height,
+                    width,
+                    height,
+                    config.get("padded-color"),
+                )
+            else:
+                eyes[0][:] = left
+                eyes[1][:] = right
+
+            # the canvas is only let go of once nothing points into it anymore
+            del canvas, eyes
+            autovrai.close_image_writer(writers.pop(key))
+
+        for key in list(writers):
+            autovrai.close_image_writer(writers.pop(key))
+    finally:
+        # whatever didn't get finished is removed instead of leaving half an image
+        for writer in writers.values():
+            autovrai.discard_image_writer(writer)
+
+    save_depth_outputs(config, depth, filepath)
+
+
+def open_output_canvas(config, key, filepath, width, height, channels):
+    # the stereo output keeps the channels of the image, padded is always RGB
+    writer = autovrai.open_image_writer(
+        output_filename(config, key, filepath),
+        2 * width,
+        height,
+        channels if key == "output-stereo" else 3,
+        canvas=True,
+    )
+    if key == "output-padded":
+        color = ImageColor.getcolor(config.get("padded-color"), "RGB")
+        writer["canvas"][:, :, :3] = color
+    return writer
+
+
+def save_depth_outputs(config, depth, filepath):
+    # the depth outputs are only as big as the depth itself, so they're saved as usual
     if config.get("output-depthmap"):
         depthmap = Image.fromarray(autovrai.colorize_depthmap(depth))
-        depthmap.save(os.path.join(config["output-depthmap"], png_file))
+        depthmap.save(output_filename(config, "output-depthmap", filepath))
 
     if config.get("output-depthraw"):
-        autovrai.save_depthraw(depth, os.path.join(config["output-depthraw"], png_file))
+        autovrai.save_depthraw(
+            depth, output_filename(config, "output-depthraw", filepath)
+        )
+
+
+def save_banded_outputs(config, image, depth, filepath):
+    # the stereo outputs are shifted and written out a band of rows at a time, so the
+    # memory they need no longer grows with the height of the image. only the input
+    # image and its depth are ever held in full
+    sizes = {}
+    if config.get("output-stereo"):
+        sizes["output-stereo"] = (2 * image.width, image.height, len(image.getbands()))
+    if config.get("output-padded"):
+        width, height = padded_size(config, image)
+        sizes["output-padded"] = (2 * width, height, 3)
+    if config.get("output-anaglyph"):
+        sizes["output-anaglyph"] = (image.width, image.height, 3)
+
+    writers = {}
+    try:
+        for key, (width, height, channels) in sizes.items():
+            writers[key] = autovrai.open_image_writer(
+                output_filename(config, key, filepath), width, height, channels
+            )
+
+        bands = autovrai.stereo_bands(
+            image, depth, stereo_intensity(config), rows=config["stereo-band-rows"]
+        )
+        while True:
+            # the lock is only held while the kernels run, so the other pipeline
+            # workers can get a band in while this one is being encoded
+            with STEREO_LOCK:
+                band = next(bands, None)
+                if band is not None and "output-anaglyph" in writers:
+                    anaglyph = autovrai.combine_anaglyph(band[1], band[2])
+            if band is None:
+                break
+
+            top, left, right = band
+            if "output-stereo" in writers:
+                stereo = autovrai.combine_stereo(left, right)
+                autovrai.write_image_rows(writers["output-stereo"], stereo)
+            if "output-padded" in writers:
+                padded = autovrai.combine_padded_band(
+                    left,
+                    right,
+                    top,
+                    image.height,
+                    sizes["output-padded"][0] // 2,
+                    sizes["output-padded"][1],
+                    config.get("padded-color"),
+                )
+                autovrai.write_image_rows(writers["output-padded"], padded)
+            if "output-anaglyph" in writers:
+                autovrai.write_image_rows(writers["output-anaglyph"], anaglyph)
+
+        for key in list(writers):
+            autovrai.close_image_writer(writers.pop(key))
+    finally:
+        # whatever didn't get finished is removed instead of leaving half an image
+        for writer in writers.values():
+            autovrai.discard_image_writer(writer)
+
+    save_depth_outputs(config, depth, filepath)
 
 
 def determine_precision_info(config):
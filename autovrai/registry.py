@@ -0,0 +1,163 @@
+import os
+import sys
+import json
+import shutil
+import hashlib
+import datetime
+from contextlib import contextmanager
+
+
+# the github repos the models are built from, ZoeDepth's own code also loads the MiDaS
+# backbone through torch hub, so both of them get a snapshot in the registry
+HUB_REPOS = {
+    "isl-org/ZoeDepth": "isl-org_ZoeDepth_main",
+    "intel-isl/MiDaS": "intel-isl_MiDaS_master",
+}
+
+
+def registry_directory(config):
+    return config.get("model-directory", os.path.join("cache", "models"))
+
+
+def read_registry(directory):
+    path = os.path.join(directory, "registry.json")
+    if not os.path.exists(path):
+        return {}
+
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def write_registry(directory, registry):
+    path = os.path.join(directory, "registry.json")
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(registry, f, indent=4, sort_keys=True)
+    os.replace(f"{path}.tmp", path)
+
+
+def add_registry_paths(config):
+    # makes the snapshot of the ZoeDepth code importable, it is used for a couple of
+    # the depth output helpers even when the model itself never needs to be loaded
+    folder = HUB_REPOS["isl-org/ZoeDepth"]
+    snapshot = os.path.join(registry_directory(config), "hub", folder)
+    if os.path.exists(snapshot) and snapshot not in sys.path:
+        sys.path.insert(0, snapshot)
+
+
+@contextmanager
+def offline_hub(directory):
+    # torch hub asks github for the default branch of a repo on every load, even when
+    # it already has a copy cached. while building from the registry, the calls made
+    # for the repos we have snapshots of are pointed at those local copies instead
+    import torch
+
+    load = torch.hub.load
+
+    def local_load(repo_or_dir, model, *args, **kwargs):
+        repo = repo_or_dir.split(":")[0]
+        if kwargs.get("source", "github") == "github" and repo in HUB_REPOS:
+            repo_or_dir = os.path.join(directory, "hub", HUB_REPOS[repo])
+            kwargs["source"] = "local"
+        return load(repo_or_dir, model, *args, **kwargs)
+
+    torch.hub.load = local_load
+    try:
+        yield
+    finally:
+        torch.hub.load = load
+
+
+def load_registered_model(config, model_name, img_size):
+    # returns None when the model hasn't been registered yet, so the caller can go and
+    # get it from torch hub. once it is registered nothing here touches the network.
+    # torch is only imported once a model is actually needed, every run adds the
+    # registry paths even when nothing ends up going through the model
+    import torch
+
+    directory = registry_directory(config)
+    entry = read_registry(directory).get(model_name)
+    if entry is None:
+        return None
+
+    path = os.path.join(directory, entry["file"])
+    if not os.path.exists(path) or os.path.getsize(path) != entry["size"]:
+        raise RuntimeError(
+            f"The registered weights for {model_name} are missing or incomplete, "
+            f"prepare the model again: {path}"
+        )
+
+    # the architecture is built from the code snapshot without any pretrained weights
+    # and then the registered weights are loaded straight into it
+    with offline_hub(directory):
+        model = torch.hub.load(
+            "isl-org/ZoeDepth",
+            model_name,
+            pretrained=False,
+            img_size=img_size,
+        )
+
+    # memory mapping means the weights are paged in as they are used instead of being
+    # read up front and then copied, older versions of torch don't support it
+    try:
+        state = torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+        model.load_state_dict(state, assign=True)
+    except TypeError:
+        state = torch.load(path, map_location="cpu")
+        model.load_state_dict(state)
+
+    add_registry_paths(config)
+    return model
+
+
+def register_model(config, model_name, model):
+    import torch
+
+    directory = registry_directory(config)
+    os.makedirs(os.path.join(directory, "hub"), exist_ok=True)
+
+    # snapshots of the code the model is built from, taken from the torch hub cache
+    # that was just used to load it, so the registry works without the hub cache
+    for repo, folder in HUB_REPOS.items():
+        snapshot = os.path.join(directory, "hub", folder)
+        if not os.path.exists(snapshot):
+            shutil.copytree(
+                os.path.join(torch.hub.get_dir(), folder),
+                snapshot,
+                ignore=shutil.ignore_patterns(".git", "__pycache__"),
+            )
+
+    path = os.path.join(directory, f"{model_name}.pt")
+    torch.save(model.state_dict(), f"{path}.tmp")
+    os.replace(f"{path}.tmp", path)
+
+    registry = read_registry(directory)
+    registry[model_name] = {
+        "file": f"{model_name}.pt",
+        "size": os.path.getsize(path),
+        "sha256": file_digest(path),
+        "torch": torch.__version__,
+        "registered": datetime.datetime.now().isoformat(timespec="seconds"),
+    }
+    write_registry(directory, registry)
+
+    print("--- AutoVR.ai ---", f"Registered {model_name} in {directory}")
+
+
+def verify_registered_model(config, model_name):
+    # the full checksum is too slow to run on every load, so it is done when the
+    # registry is copied to a new machine or whenever the weights are in question
+    directory = registry_directory(config)
+    entry = read_registry(directory).get(model_name)
+    if entry is None:
+        return False
+
+    path = os.path.join(directory, entry["file"])
+    return os.path.exists(path) and file_digest(path) == entry["sha256"]
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(2**20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -1,16 +1,57 @@
 import numpy as np
-from numba import njit, prange
-from PIL import Image
+from numba import njit, prange, get_num_threads
+from PIL import Image, ImageColor
+
+
+# the kernels are compiled for these explicit types and cached on disk by numba, so
+# only the very first run on a machine pays for compiling them. images are always
+# uint8 and C ordered coming from `np.array`, the depths are float32 coming from the
+# model (or the caches and inputs) and float64 coming out of the tiled upscale. the
+# eyes and the anaglyph are written into views of the side by side buffer or of the
+# output canvases, so those are any layout
+DEPTH_TYPES = ["float32", "float64"]
+
+FUSED_SIGNATURES = [
+    f"void(uint8[:, :, ::1], {depth}[:, :], {depth}, {depth}, float64, unicode_type, "
+    "uint8[:, :, :], uint8[:, :, :], int64)"
+    for depth in DEPTH_TYPES
+]
+ANAGLYPH_SIGNATURES = ["void(uint8[:, :, :], uint8[:, :, :], uint8[:, :, :])"]
 
 
 def combine_stereo(left, right):
-    return Image.fromarray(np.hstack([left, right]))
+    # the eyes from `stereo_eyes` already live side by side in one buffer
+    stereo = stereo_buffer(left, right)
+    if stereo is None:
+        stereo = np.hstack([left, right])
+    return Image.fromarray(stereo)
 
 
 def combine_anaglyph(left, right):
     return Image.fromarray(generate_anaglyph(left, right))
 
 
+def generate_anaglyph(left, right):
+    anaglyph = np.zeros((left.shape[0], left.shape[1], 3), np.uint8)
+    apply_anaglyph(left, right, anaglyph)
+    return anaglyph
+
+
+def canvas_eyes(canvas, width, height, eye_width, eye_height, channels):
+    # the views of a side by side canvas (two halves of `width`) where the eyes end up
+    # when they're centered in their halves, the same place `combine_padded` pastes
+    # them, so the eyes can be written there directly. there's no view for an eye that
+    # doesn't fit inside its half, PIL's paste would have clipped it
+    x = width // 2 - eye_width // 2
+    y = height // 2 - eye_height // 2
+    if x < 0 or y < 0 or x + eye_width > width or y + eye_height > height:
+        return None
+
+    left = canvas[y : y + eye_height, x : x + eye_width, :channels]
+    right = canvas[y : y + eye_height, width + x : width + x + eye_width, :channels]
+    return left, right
+
+
 def combine_padded(left, right, width, height, color):
     left_image = Image.fromarray(left)
     right_image = Image.fromarray(right)
@@ -31,166 +72,410 @@ def combine_padded(left, right, width, height, color):
     return image
 
 
+def combine_padded_band(left, right, top, image_height, width, height, color):
+    # the rows of `combine_padded` that a band from `stereo_bands` ends up on. the
+    # first and last bands also cover the padding above and below the eyes, so writing
+    # out every band in order gives the whole padded image
+    eye_height, eye_width = left.shape[:2]
+    offset = height // 2 - image_height // 2
+    start = 0 if top == 0 else top + offset
+    end = height if top + eye_height == image_height else top + eye_height + offset
+    start = min(max(start, 0), height)
+    end = min(max(end, start), height)
+
+    band = np.empty((end - start, 2 * width, 3), dtype=np.uint8)
+    band[:] = ImageColor.getcolor(color, "RGB")
+
+    # pasted the same way as PIL does, the left eye first and both of them clipped
+    # only by the edges of the whole image
+    for eye, x in [
+        (left, width // 2 - eye_width // 2),
+        (right, width + width // 2 - eye_width // 2),
+    ]:
+        first = max(top + offset, start)
+        last = min(top + offset + eye_height, end)
+        first_x = max(x, 0)
+        last_x = min(x + eye_width, 2 * width)
+        if first >= last or first_x >= last_x:
+            continue
+        band[first - start : last - start, first_x:last_x] = eye[
+            first - top - offset : last - top - offset,
+            first_x - x : last_x - x,
+            :3,
+        ]
+
+    return band
+
+
 def stereo_eyes(
     image: Image,
     depth: np.ndarray,
     divergence: float,
     fill_technique="polylines_sharp",
+    left=None,
+    right=None,
 ):
     original = np.array(image)
-    width = original.shape[1]
-
-    depth_min = depth.min()
-    depth_max = depth.max()
-    depth_normal = (depth - depth_min) / (depth_max - depth_min)
+    height, width, channels = original.shape
+    depth, depth_min, depth_max = depth_range(depth)
 
     diverge_pixels = ((divergence / 2) / 100.0) * width
 
-    left = apply_stereo_divergence_polylines(
-        original, depth_normal, diverge_pixels, fill_technique
-    )
-    right = apply_stereo_divergence_polylines(
-        original, depth_normal, diverge_pixels * -1, fill_technique
+    # both eyes are written straight into the two halves of a single side by side
+    # buffer, so `combine_stereo` can hand that buffer over without another copy. the
+    # eyes can also be given, like the views of an output canvas from `canvas_eyes`
+    if left is None or right is None:
+        stereo = np.zeros((height, 2 * width, channels), dtype=original.dtype)
+        left = stereo[:, :width]
+        right = stereo[:, width:]
+
+    apply_stereo_divergence_fused(
+        original,
+        depth,
+        depth_min,
+        depth_max,
+        diverge_pixels,
+        fill_technique,
+        left,
+        right,
+        get_num_threads(),
     )
 
     return left, right
 
 
-@njit(parallel=True)  # fastmath=True does not reasonably improve performance
-def apply_stereo_divergence_polylines(
-    original_image, normalized_depth, divergence_px: float, fill_technique
+def stereo_bands(
+    image: Image,
+    depth: np.ndarray,
+    divergence: float,
+    fill_technique="polylines_sharp",
+    rows=256,
+):
+    # the same as `stereo_eyes`, but a band of `rows` rows at a time, yielding the top
+    # row of each band along with its left and right eyes. every row is shifted on its
+    # own, so the results are exactly the same as doing the whole image at once. only
+    # the depth is needed in full, for the min and max it is normalized with. the eyes
+    # are views into a buffer that is reused for the next band, so they need to be used
+    # (or copied) before asking for it
+    width, height = image.size
+    depth, depth_min, depth_max = depth_range(depth)
+    diverge_pixels = ((divergence / 2) / 100.0) * width
+
+    stereo = None
+    for top in range(0, height, rows):
+        bottom = min(top + rows, height)
+        original = np.array(image.crop((0, top, width, bottom)))
+        if stereo is None:
+            stereo = np.zeros((rows, 2 * width, original.shape[2]), dtype=np.uint8)
+
+        left = stereo[: bottom - top, :width]
+        right = stereo[: bottom - top, width:]
+        apply_stereo_divergence_fused(
+            original,
+            depth[top:bottom],
+            depth_min,
+            depth_max,
+            diverge_pixels,
+            fill_technique,
+            left,
+            right,
+            get_num_threads(),
+        )
+        yield top, left, right
+
+
+def depth_range(depth):
+    # the kernels are only compiled for writable arrays, a depth that wraps something
+    # else (like a PIL image) can come in read only, so that gets a copy of its own
+    if not depth.flags.writeable:
+        depth = np.array(depth)
+
+    # the min and max keep the depth's own dtype so the normalization done inside the
+    # kernel comes out exactly the same as doing it up front with numpy
+    depth_min = depth.min()
+    depth_max = depth.max()
+
+    # a completely flat depth map can't be normalized, treat it as all the same depth
+    if depth_max == depth_min:
+        depth = np.zeros_like(depth)
+        depth_min = depth.dtype.type(0)
+        depth_max = depth.dtype.type(1)
+
+    return depth, depth_min, depth_max
+
+
+def warmup_stereo():
+    # runs every kernel once on a tiny image, which loads them from numba's cache (or
+    # compiles them on the very first run) and starts up numba's threads, so none of
+    # that ends up being paid for by the first real image
+    image = Image.new("RGB", (16, 16))
+    for dtype in DEPTH_TYPES:
+        depth = np.linspace(0, 1, 16 * 16, dtype=dtype).reshape(16, 16)
+        left, right = stereo_eyes(image, depth, 1.0)
+        generate_anaglyph(left, right)
+
+
+def stereo_buffer(left, right):
+    # returns the side by side buffer the eyes were written into by `stereo_eyes`, but
+    # only if the left and right really are its two halves in that exact order
+    base = left.base
+    if base is None or right.base is not base or base.ndim != 3:
+        return None
+    if base.shape[0] != left.shape[0] or base.shape[1] != 2 * left.shape[1]:
+        return None
+    if left.ctypes.data != base.ctypes.data:
+        return None
+    if right.ctypes.data != base.ctypes.data + left.shape[1] * base.strides[1]:
+        return None
+    return base
+
+
+@njit(nogil=True, cache=True)
+def allocate_polyline_scratch(w, c):
+    # vertices of the morphed polyline, kept as separate arrays so swapping or
+    # copying a vertex never needs a temporary array
+    # format: new coordinate of the vertex, divergence (closeness), column of pixel that contains the point's color
+    pt_x = np.zeros(5 + 2 * w, dtype=np.float64)
+    pt_d = np.zeros(5 + 2 * w, dtype=np.float64)
+    pt_c = np.zeros(5 + 2 * w, dtype=np.int64)
+    # vertex indexes in sorted order along with their sorted coordinates. segment i
+    # always goes from vertex i to vertex i + 1, so this is also the segment order
+    order = np.zeros(5 + 2 * w, dtype=np.int64)
+    sorted_x = np.zeros(5 + 2 * w, dtype=np.float64)
+    # segments that are "active" (or "current"), stored by their vertex index
+    csg = np.zeros(5 + 2 * w, dtype=np.int64)
+    color = np.zeros(c, dtype=np.float64)
+
+    return pt_x, pt_d, pt_c, order, sorted_x, csg, color
+
+
+@njit(nogil=True, cache=True)
+def apply_stereo_divergence_row(
+    original_row, depth_factor, divergence_px, PIXEL_HALF_WIDTH, derived_row, scratch
 ):
     # This code treats rows of the image as polylines
     # It generates polylines, morphs them (applies divergence) to them, and then rasterizes them
     EPSILON = 1e-7
+
+    w, c = original_row.shape
+    pt_x, pt_d, pt_c, order, sorted_x, csg, color = scratch
+
+    # generating the vertices of the morphed polyline
+    pt_end: int = 0
+    pt_x[pt_end] = -3.0 * abs(divergence_px)
+    pt_d[pt_end] = 0.0
+    pt_c[pt_end] = 0
+    pt_end += 1
+    for col in range(0, w):
+        coord_d = depth_factor[col] * divergence_px
+        coord_x = col + 0.5 + coord_d
+        if PIXEL_HALF_WIDTH < EPSILON:
+            pt_x[pt_end] = coord_x
+            pt_d[pt_end] = abs(coord_d)
+            pt_c[pt_end] = col
+            pt_end += 1
+        else:
+            pt_x[pt_end] = coord_x - PIXEL_HALF_WIDTH
+            pt_d[pt_end] = abs(coord_d)
+            pt_c[pt_end] = col
+            pt_x[pt_end + 1] = coord_x + PIXEL_HALF_WIDTH
+            pt_d[pt_end + 1] = abs(coord_d)
+            pt_c[pt_end + 1] = col
+            pt_end += 2
+    pt_x[pt_end] = w + 3.0 * abs(divergence_px)
+    pt_d[pt_end] = 0.0
+    pt_c[pt_end] = w - 1
+    pt_end += 1
+
+    # the segments of the morphed polyline are implied by consecutive vertices
+    sg_end: int = pt_end - 1
+    # Here is an informal proof that this (morphed) polyline does not self-intersect:
+    # Draw a plot with two axes: coord_x and coord_d. Now draw the original line - it will be positioned at the
+    # bottom of the graph (that is, for every point coord_d == 0). Now draw the morphed line using the vertices of
+    # the original polyline. Observe that for each vertex in the new polyline, its increments
+    # (from the corresponding vertex in the old polyline) over coord_x and coord_d are in direct proportion.
+    # In fact, this proportion is equal for all the vertices and it is equal either -1 or +1,
+    # depending on the sign of divergence_px. Now draw the lines from each old vertex to a corresponding new vertex.
+    # Since the proportions are equal, these lines have the same angle with an axe and are parallel.
+    # So, these lines do not intersect. Now rotate the plot by 45 or -45 degrees and observe that
+    # each dot of the polyline is further right from the last dot,
+    # which makes it impossible for the polyline to self-interset. QED.
+
+    # sort segments and points using insertion sort
+    # has a very good performance in practice, since these are almost sorted to begin with
+    # only the indexes move, shifted over instead of swapping rows
+    for i in range(sg_end):
+        key = i
+        key_x = pt_x[i]
+        u = i - 1
+        while 0 <= u and sorted_x[u] > key_x:
+            order[u + 1] = order[u]
+            sorted_x[u + 1] = sorted_x[u]
+            u -= 1
+        order[u + 1] = key
+        sorted_x[u + 1] = key_x
+    sorted_x[sg_end] = pt_x[sg_end]
+
+    # rasterizing
+    # at each point in time we keep track of segments that are "active" (or "current")
+    csg_end: int = 0
+    sg_pointer: int = 0
+    # and index of the point that should be processed next
+    pt_i: int = 0
+    for col in range(w):
+        # iterate over regions (that will be rasterizeed into pixels)
+        for ch in range(c):
+            # we start with 0.5 because of how floats are converted to ints
+            color[ch] = 0.5
+        while sorted_x[pt_i] < col:
+            pt_i += 1
+        pt_i -= 1  # pt_i now points to the dot before the region start
+        # Finding segment' parts that contribute color to the region
+        while sorted_x[pt_i] < col + 1:
+            coord_from = max(col, sorted_x[pt_i]) + EPSILON
+            coord_to = min(col + 1, sorted_x[pt_i + 1]) - EPSILON
+            significance = coord_to - coord_from
+            # the color at center point is the same as the average of color of segment part
+            coord_center = coord_from + 0.5 * significance
+
+            # adding semgents that now may contribute
+            while sg_pointer < sg_end and sorted_x[sg_pointer] < coord_center:
+                csg[csg_end] = order[sg_pointer]
+                sg_pointer += 1
+                csg_end += 1
+            # removing segments that will no longer contribute, and in the same
+            # pass finding the closest segment (segment with most divergence).
+            # an entry is only looked at once it has its final position, so the
+            # tie breaking is the same as removing first and searching after
+            # note that this segment will be the closest from coord_from right up to coord_to, since there
+            # no new segments "appearing" inbetween these two and _the polyline does not self-intersect_
+            best_csg_i: int = 0
+            best_csg_closeness: float = -EPSILON
+            csg_i = 0
+            while csg_i < csg_end:
+                sg_i = csg[csg_i]
+                if pt_x[sg_i + 1] < coord_center:
+                    csg[csg_i] = csg[csg_end - 1]
+                    csg_end -= 1
+                    continue
+                span = pt_x[sg_i + 1] - pt_x[sg_i]
+                if span != 0.0:
+                    ip_k = (coord_center - pt_x[sg_i]) / span
+                    # assert 0.0 <= ip_k <= 1.0
+                    d_from = pt_d[sg_i]
+                    d_to = pt_d[sg_i + 1]
+                    closeness = (1.0 - ip_k) * d_from + ip_k * d_to
+                    if best_csg_closeness < closeness and 0.0 < ip_k < 1.0:
+                        best_csg_closeness = closeness
+                        best_csg_i = csg_i
+                csg_i += 1
+            if csg_end == 1:
+                best_csg_i = 0
+            # getting the color
+            sg_i = csg[best_csg_i]
+            col_l = pt_c[sg_i]
+            col_r = pt_c[sg_i + 1]
+            if col_l == col_r:
+                for ch in range(c):
+                    color[ch] += original_row[col_l][ch] * significance
+            else:
+                ip_k = (coord_center - pt_x[sg_i]) / (pt_x[sg_i + 1] - pt_x[sg_i])
+                for ch in range(c):
+                    color[ch] += (
+                        original_row[col_l][ch] * (1.0 - ip_k)
+                        + original_row[col_r][ch] * ip_k
+                    ) * significance
+            pt_i += 1
+        for ch in range(c):
+            derived_row[col][ch] = np.uint8(color[ch])
+
+
+# fastmath=True does not reasonably improve performance, nogil=True lets the kernel
+# run on a pipeline worker thread without holding up the model on the main thread
+@njit(parallel=True, nogil=True, cache=True)
+def apply_stereo_divergence_polylines(
+    original_image, normalized_depth, divergence_px: float, fill_technique, threads
+):
     PIXEL_HALF_WIDTH = 0.45 if fill_technique == "polylines_sharp" else 0.0
-    # PERF_COUNTERS = [0, 0, 0]
 
     h, w, c = original_image.shape
     derived_image = np.zeros_like(original_image)
-    for row in prange(h):
-        # generating the vertices of the morphed polyline
-        # format: new coordinate of the vertex, divergence (closeness), column of pixel that contains the point's color
-        pt = np.zeros((5 + 2 * w, 3), dtype=np.float_)
-        pt_end: int = 0
-        pt[pt_end] = [-3.0 * abs(divergence_px), 0.0, 0.0]
-        pt_end += 1
-        for col in range(0, w):
-            coord_d = (1 - normalized_depth[row][col] ** 2) * divergence_px
-            coord_x = col + 0.5 + coord_d
-            if PIXEL_HALF_WIDTH < EPSILON:
-                pt[pt_end] = [coord_x, abs(coord_d), col]
-                pt_end += 1
-            else:
-                pt[pt_end] = [coord_x - PIXEL_HALF_WIDTH, abs(coord_d), col]
-                pt[pt_end + 1] = [coord_x + PIXEL_HALF_WIDTH, abs(coord_d), col]
-                pt_end += 2
-        pt[pt_end] = [w + 3.0 * abs(divergence_px), 0.0, w - 1]
-        pt_end += 1
-
-        # generating the segments of the morphed polyline
-        # format: coord_x, coord_d, color_i of the first point, then the same for the second point
-        sg_end: int = pt_end - 1
-        sg = np.zeros((sg_end, 6), dtype=np.float_)
-        for i in range(sg_end):
-            sg[i] += np.concatenate((pt[i], pt[i + 1]))
-        # Here is an informal proof that this (morphed) polyline does not self-intersect:
-        # Draw a plot with two axes: coord_x and coord_d. Now draw the original line - it will be positioned at the
-        # bottom of the graph (that is, for every point coord_d == 0). Now draw the morphed line using the vertices of
-        # the original polyline. Observe that for each vertex in the new polyline, its increments
-        # (from the corresponding vertex in the old polyline) over coord_x and coord_d are in direct proportion.
-        # In fact, this proportion is equal for all the vertices and it is equal either -1 or +1,
-        # depending on the sign of divergence_px. Now draw the lines from each old vertex to a corresponding new vertex.
-        # Since the proportions are equal, these lines have the same angle with an axe and are parallel.
-        # So, these lines do not intersect. Now rotate the plot by 45 or -45 degrees and observe that
-        # each dot of the polyline is further right from the last dot,
-        # which makes it impossible for the polyline to self-interset. QED.
-
-        # sort segments and points using insertion sort
-        # has a very good performance in practice, since these are almost sorted to begin with
-        for i in range(1, sg_end):
-            u = i - 1
-            while pt[u][0] > pt[u + 1][0] and 0 <= u:
-                pt[u], pt[u + 1] = np.copy(pt[u + 1]), np.copy(pt[u])
-                sg[u], sg[u + 1] = np.copy(sg[u + 1]), np.copy(sg[u])
-                u -= 1
-
-        # rasterizing
-        # at each point in time we keep track of segments that are "active" (or "current")
-        csg = np.zeros((5 * int(abs(divergence_px)) + 25, 6), dtype=np.float_)
-        csg_end: int = 0
-        sg_pointer: int = 0
-        # and index of the point that should be processed next
-        pt_i: int = 0
-        for col in range(
-            w
-        ):  # iterate over regions (that will be rasterizeed into pixels)
-            color = np.full(
-                c, 0.5, dtype=np.float_
-            )  # we start with 0.5 because of how floats are converted to ints
-            while pt[pt_i][0] < col:
-                pt_i += 1
-            pt_i -= 1  # pt_i now points to the dot before the region start
-            # Finding segment' parts that contribute color to the region
-            while pt[pt_i][0] < col + 1:
-                coord_from = max(col, pt[pt_i][0]) + EPSILON
-                coord_to = min(col + 1, pt[pt_i + 1][0]) - EPSILON
-                significance = coord_to - coord_from
-                # the color at center point is the same as the average of color of segment part
-                coord_center = coord_from + 0.5 * significance
-
-                # adding semgents that now may contribute
-                while sg_pointer < sg_end and sg[sg_pointer][0] < coord_center:
-                    csg[csg_end] = sg[sg_pointer]
-                    sg_pointer += 1
-                    csg_end += 1
-                # removing segments that will no longer contribute
-                csg_i = 0
-                while csg_i < csg_end:
-                    if csg[csg_i][3] < coord_center:
-                        csg[csg_i] = csg[csg_end - 1]
-                        csg_end -= 1
-                    else:
-                        csg_i += 1
-                # finding the closest segment (segment with most divergence)
-                # note that this segment will be the closest from coord_from right up to coord_to, since there
-                # no new segments "appearing" inbetween these two and _the polyline does not self-intersect_
-                best_csg_i: int = 0
-                # PERF_COUNTERS[0] += 1
-                if csg_end != 1:
-                    # PERF_COUNTERS[1] += 1
-                    best_csg_closeness: float = -EPSILON
-                    for csg_i in range(csg_end):
-                        ip_k = (coord_center - csg[csg_i][0]) / (
-                            csg[csg_i][3] - csg[csg_i][0]
-                        )
-                        # assert 0.0 <= ip_k <= 1.0
-                        closeness = (1.0 - ip_k) * csg[csg_i][1] + ip_k * csg[csg_i][4]
-                        if best_csg_closeness < closeness and 0.0 < ip_k < 1.0:
-                            best_csg_closeness = closeness
-                            best_csg_i = csg_i
-                # getting the color
-                col_l: int = int(csg[best_csg_i][2] + EPSILON)
-                col_r: int = int(csg[best_csg_i][5] + EPSILON)
-                if col_l == col_r:
-                    color += original_image[row][col_l] * significance
-                else:
-                    # PERF_COUNTERS[2] += 1
-                    ip_k = (coord_center - csg[best_csg_i][0]) / (
-                        csg[best_csg_i][3] - csg[best_csg_i][0]
-                    )
-                    color += (
-                        original_image[row][col_l] * (1.0 - ip_k)
-                        + original_image[row][col_r] * ip_k
-                    ) * significance
-                pt_i += 1
-            derived_image[row][col] = np.asarray(color, dtype=np.uint8)
-    # print(PERF_COUNTERS)
+
+    # the scratch buffers are allocated once per thread instead of once per row (or
+    # per pixel), so the rows are interleaved across a fixed number of threads. the
+    # number of threads is passed in, calling numba's `get_num_threads` in here would
+    # stop the kernel from being cached
+    threads = max(min(threads, h), 1)
+    for thread in prange(threads):
+        scratch = allocate_polyline_scratch(w, c)
+        depth_factor = np.zeros(w, dtype=np.float64)
+
+        for row in range(thread, h, threads):
+            for col in range(w):
+                depth_factor[col] = 1 - normalized_depth[row][col] ** 2
+
+            apply_stereo_divergence_row(
+                original_image[row],
+                depth_factor,
+                divergence_px,
+                PIXEL_HALF_WIDTH,
+                derived_image[row],
+                scratch,
+            )
     return derived_image
 
 
-@njit(parallel=True)
-def generate_anaglyph(left, right):
+@njit(FUSED_SIGNATURES, parallel=True, nogil=True, cache=True)
+def apply_stereo_divergence_fused(
+    original_image,
+    depth,
+    depth_min,
+    depth_max,
+    divergence_px: float,
+    fill_technique,
+    left,
+    right,
+    threads,
+):
+    # same as calling `apply_stereo_divergence_polylines` once with divergence_px and
+    # once with its negation, but in a single pass. each row is read, normalized and
+    # turned into its (1 - d**2) term once, then used for both eyes. the results are
+    # written into `left` and `right`, which can be views into a bigger output buffer
+    PIXEL_HALF_WIDTH = 0.45 if fill_technique == "polylines_sharp" else 0.0
+
+    h, w, c = original_image.shape
+    depth_range = depth_max - depth_min
+
+    threads = max(min(threads, h), 1)
+    for thread in prange(threads):
+        scratch = allocate_polyline_scratch(w, c)
+        depth_factor = np.zeros(w, dtype=np.float64)
+
+        for row in range(thread, h, threads):
+            for col in range(w):
+                normalized = (depth[row][col] - depth_min) / depth_range
+                depth_factor[col] = 1 - normalized**2
+
+            apply_stereo_divergence_row(
+                original_image[row],
+                depth_factor,
+                divergence_px,
+                PIXEL_HALF_WIDTH,
+                left[row],
+                scratch,
+            )
+            apply_stereo_divergence_row(
+                original_image[row],
+                depth_factor,
+                -divergence_px,
+                PIXEL_HALF_WIDTH,
+                right[row],
+                scratch,
+            )
+
+
+@njit(ANAGLYPH_SIGNATURES, parallel=True, nogil=True, cache=True)
+def apply_anaglyph(left, right, anaglyph):
     if left.shape != right.shape:
         raise ValueError(
             "Images for the left and right eye must be the same size for an anaglyph"
@@ -199,9 +484,7 @@ def generate_anaglyph(left, right):
     height = left.shape[0]
     width = left.shape[1]
 
-    # final image container
-    anaglyph = np.zeros((height, width, 3), np.uint8)
-
+    # the final image is written into `anaglyph`, which can be a view of a canvas
     for h in prange(height):
         for w in range(width):
             # red channel is from left image/eye
@@ -209,5 +492,3 @@ def generate_anaglyph(left, right):
             # blue/green channels are from right image/eye
             anaglyph[h, w, 1] = right[h, w, 1]
             anaglyph[h, w, 2] = right[h, w, 2]
-
-    return anaglyph
@@ -1,4 +1,8 @@
 import os
+import math
+import time
+import contextlib
+import collections
 import numpy as np
 from PIL import Image
 from scipy.ndimage import gaussian_filter
@@ -6,256 +10,420 @@ from scipy.ndimage import gaussian_filter
 import autovrai
 
 
-def handle_tiles(model, image, low_res_depth):
-    autovrai.print_current_datetime("Starting combine process")
-    if not os.path.exists("combined"):
-        os.makedirs("combined")
+# the tile batch sizes that worked for each tile resolution, it only ever goes down
+TILE_BATCH_SIZES = {}
 
-    low_res_scaled_depth = 2**16 - (
-        low_res_depth - np.min(low_res_depth)
-    ) * 2**16 / (np.max(low_res_depth) - np.min(low_res_depth))
-    autovrai.print_current_datetime("After scaling low res depth map")
+# the most recently used filters for each image size and tile grid
+FILTERS = collections.OrderedDict()
+FILTERS_LIMIT = 4
 
-    low_res_depth_map_image = Image.fromarray(
-        (0.999 * low_res_scaled_depth).astype("uint16")
-    )
-    autovrai.print_current_datetime("After converting low res depth map to image")
 
-    low_res_depth_map_image.save("zoe_depth_map_16bit_low.png")
-    autovrai.print_current_datetime("After saving low res depth map image")
+def handle_tiles(config, image, low_res_depth, resolution, name):
+    # `name` is what the debug images of this input are saved under, if turned on
+    autovrai.print_current_datetime("Starting combine process")
+    timings = collections.defaultdict(float)
+
+    with timed(timings, "scaling"):
+        low_res_scaled_depth = 2**16 - (
+            low_res_depth - np.min(low_res_depth)
+        ) * 2**16 / (np.max(low_res_depth) - np.min(low_res_depth))
+
+    autovrai.save_debug_image(
+        config,
+        name,
+        "depth_16bit_low.png",
+        lambda: Image.fromarray((0.999 * low_res_scaled_depth).astype("uint16")),
+    )
 
-    im, filters, tile_sizes = generate_filters(image, save_filter_images=True)
-    autovrai.print_current_datetime("After generating filters")
+    with timed(timings, "filters"):
+        im, filters, tile_sizes = generate_filters(config, image)
 
     compiled_tiles_list = apply_filters(
-        model, im, filters, tile_sizes, low_res_scaled_depth, save_tiled_depth_map=True
+        config,
+        name,
+        im,
+        filters,
+        tile_sizes,
+        low_res_scaled_depth,
+        resolution,
+        timings,
     )
-    autovrai.print_current_datetime("After applying filters")
 
-    combined_result = combine_depthmaps(im, compiled_tiles_list, low_res_scaled_depth)
-    autovrai.print_current_datetime("After combining depth maps")
+    with timed(timings, "combining"):
+        combined_result = combine_depthmaps(
+            config, name, im, compiled_tiles_list, low_res_scaled_depth
+        )
 
     # not working as expected yet
     # inverted = cv2.bitwise_not(combined_result)
     # autovrai.print_current_datetime("After inverting depth map")
 
+    # where the time went, so it's easy to see which part is worth working on next
+    print(
+        "--- AutoVR.ai ---",
+        f"Tiled upscale took {sum(timings.values()):.2f}s: "
+        + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in timings.items()),
+    )
+
     return combined_result
 
 
-def generate_filters(image, save_filter_images):
+@contextlib.contextmanager
+def timed(timings, name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] += time.perf_counter() - start
+
+
+def generate_filters(config, image):
     # store filters in lists
     im = np.asarray(image)
     tile_sizes = [[4, 4], [8, 8]]
     filters = []
-    # save_filter_images = True
-    # save_tiled_depth_map = True
 
     for tile_size in tile_sizes:
         num_x = tile_size[0]
         num_y = tile_size[1]
 
+        # the filters only depend on the size of the tiles, so they are only built the
+        # first time an image of this size comes through. the images are grouped by
+        # size, so a handful of entries is all that is needed to cover a whole batch
+        key = (im.shape[:2], num_x, num_y)
+        if key in FILTERS:
+            FILTERS.move_to_end(key)
+            filters.append(FILTERS[key])
+            continue
+
         M = im.shape[0] // num_x
         N = im.shape[1] // num_y
+        filter_dict = build_filters(M, N)
 
-        filter_dict = {}
-        filter_dict["right_filter"] = np.zeros((M, N))
-        filter_dict["left_filter"] = np.zeros((M, N))
-        filter_dict["top_filter"] = np.zeros((M, N))
-        filter_dict["bottom_filter"] = np.zeros((M, N))
-        filter_dict["top_right_filter"] = np.zeros((M, N))
-        filter_dict["top_left_filter"] = np.zeros((M, N))
-        filter_dict["bottom_right_filter"] = np.zeros((M, N))
-        filter_dict["bottom_left_filter"] = np.zeros((M, N))
-        filter_dict["filter"] = np.zeros((M, N))
-
-        # left_filter = np.zeros((M, N))
-        # top_filter = np.zeros((M, N))
-        # bottom_filter = np.zeros((M, N))
-
-        # top_right_filter = np.zeros((M, N))
-        # top_left_filter = np.zeros((M, N))
-        # bottom_right_filter = np.zeros((M, N))
-        # bottom_left_filter = np.zeros((M, N))
-
-        # filter = np.zeros((M, N))
-
-        for i in range(M):
-            for j in range(N):
-                x_value = 0.998 * np.cos((abs(M / 2 - i) / M) * np.pi) ** 2
-                y_value = 0.998 * np.cos((abs(N / 2 - j) / N) * np.pi) ** 2
-
-                if j > N / 2:
-                    filter_dict["right_filter"][i, j] = x_value
-                else:
-                    filter_dict["right_filter"][i, j] = x_value * y_value
-
-                if j < N / 2:
-                    filter_dict["left_filter"][i, j] = x_value
-                else:
-                    filter_dict["left_filter"][i, j] = x_value * y_value
-
-                if i < M / 2:
-                    filter_dict["top_filter"][i, j] = y_value
-                else:
-                    filter_dict["top_filter"][i, j] = x_value * y_value
-
-                if i > M / 2:
-                    filter_dict["bottom_filter"][i, j] = y_value
-                else:
-                    filter_dict["bottom_filter"][i, j] = x_value * y_value
-
-                if j > N / 2 and i < M / 2:
-                    filter_dict["top_right_filter"][i, j] = 0.998
-                elif j > N / 2:
-                    filter_dict["top_right_filter"][i, j] = x_value
-                elif i < M / 2:
-                    filter_dict["top_right_filter"][i, j] = y_value
-                else:
-                    filter_dict["top_right_filter"][i, j] = x_value * y_value
-
-                if j < N / 2 and i < M / 2:
-                    filter_dict["top_left_filter"][i, j] = 0.998
-                elif j < N / 2:
-                    filter_dict["top_left_filter"][i, j] = x_value
-                elif i < M / 2:
-                    filter_dict["top_left_filter"][i, j] = y_value
-                else:
-                    filter_dict["top_left_filter"][i, j] = x_value * y_value
-
-                if j > N / 2 and i > M / 2:
-                    filter_dict["bottom_right_filter"][i, j] = 0.998
-                elif j > N / 2:
-                    filter_dict["bottom_right_filter"][i, j] = x_value
-                elif i > M / 2:
-                    filter_dict["bottom_right_filter"][i, j] = y_value
-                else:
-                    filter_dict["bottom_right_filter"][i, j] = x_value * y_value
-
-                if j < N / 2 and i > M / 2:
-                    filter_dict["bottom_left_filter"][i, j] = 0.998
-                elif j < N / 2:
-                    filter_dict["bottom_left_filter"][i, j] = x_value
-                elif i > M / 2:
-                    filter_dict["bottom_left_filter"][i, j] = y_value
-                else:
-                    filter_dict["bottom_left_filter"][i, j] = x_value * y_value
-
-                filter_dict["filter"][i, j] = x_value * y_value
+        FILTERS[key] = filter_dict
+        if len(FILTERS) > FILTERS_LIMIT:
+            FILTERS.popitem(last=False)
 
         filters.append(filter_dict)
 
-        if save_filter_images:
-            for filter in list(filter_dict.keys()):
-                filter_image = Image.fromarray(
-                    (filter_dict[filter] * 2**16).astype("uint16")
-                )
-                filter_image.save(
-                    os.path.join("combined", f"mask_{filter}_{num_x}_{num_y}.png")
-                )
+        # the filters are the same for every image of this size, so they're only saved
+        # when they are built, under the size instead of the name of an input
+        for filter in list(filter_dict.keys()):
+            autovrai.save_debug_image(
+                config,
+                os.path.join("filters", f"{im.shape[1]}x{im.shape[0]}"),
+                f"mask_{filter}_{num_x}_{num_y}.png",
+                lambda values=filter_dict[filter]: Image.fromarray(
+                    (values * 2**16).astype("uint16")
+                ),
+            )
 
     return im, filters, tile_sizes
 
 
+def build_filters(M, N):
+    # the rows (i) and columns (j) are kept as a column and a row, broadcasting them
+    # against each other gives the full M by N filter without looping over the pixels
+    i = np.arange(M)[:, np.newaxis]
+    j = np.arange(N)[np.newaxis, :]
+
+    x_value = 0.998 * np.cos((np.abs(M / 2 - i) / M) * np.pi) ** 2
+    y_value = 0.998 * np.cos((np.abs(N / 2 - j) / N) * np.pi) ** 2
+    both = x_value * y_value
+
+    right = j > N / 2
+    left = j < N / 2
+    top = i < M / 2
+    bottom = i > M / 2
+
+    # fades out on every side except the one (or the corner) along the image edge
+    def corner(horizontal, vertical):
+        return np.where(
+            horizontal & vertical,
+            0.998,
+            np.where(horizontal, x_value, np.where(vertical, y_value, both)),
+        )
+
+    filter_dict = {}
+    filter_dict["right_filter"] = np.where(right, x_value, both)
+    filter_dict["left_filter"] = np.where(left, x_value, both)
+    filter_dict["top_filter"] = np.where(top, y_value, both)
+    filter_dict["bottom_filter"] = np.where(bottom, y_value, both)
+    filter_dict["top_right_filter"] = corner(right, top)
+    filter_dict["top_left_filter"] = corner(left, top)
+    filter_dict["bottom_right_filter"] = corner(right, bottom)
+    filter_dict["bottom_left_filter"] = corner(left, bottom)
+    filter_dict["filter"] = both
+
+    # these are shared by every image of the same size, nothing should ever change them.
+    # float32 is plenty for a fade between 0 and 1, and is what the tiles are blended in
+    for name in filter_dict:
+        filter_dict[name] = filter_dict[name].astype(np.float32)
+        filter_dict[name].setflags(write=False)
+
+    return filter_dict
+
+
+def tile_schedule(shape, tile_size):
+    # the tiles for one tile size: a regular grid, plus a second grid offset by half a
+    # tile so the seams of the first one end up in the middle of a tile. each tile is
+    # (x, y, name of the filter that blends it in), and every one is exactly M by N
+    num_x = tile_size[0]
+    num_y = tile_size[1]
+
+    M = shape[0] // num_x
+    N = shape[1] // num_y
+
+    x_coords = list(range(0, shape[0], M))[:num_x]
+    y_coords = list(range(0, shape[1], N))[:num_y]
+
+    x_coords_between = list(range(M // 2, shape[0], M))[: num_x - 1]
+    y_coords_between = list(range(N // 2, shape[1], N))[: num_y - 1]
+
+    x_coords_all = x_coords + x_coords_between
+    y_coords_all = y_coords + y_coords_between
+
+    tiles = []
+    for x in x_coords_all:
+        for y in y_coords_all:
+            tiles.append((x, y, tile_filter_name(x, y, x_coords_all, y_coords_all)))
+
+    return M, N, tiles
+
+
+def tile_filter_name(x, y, x_coords_all, y_coords_all):
+    # the tiles along the edges of the image fade out towards the middle only
+    if y == min(y_coords_all) and x == min(x_coords_all):
+        return "top_left_filter"
+    elif y == min(y_coords_all) and x == max(x_coords_all):
+        return "bottom_left_filter"
+    elif y == max(y_coords_all) and x == min(x_coords_all):
+        return "top_right_filter"
+    elif y == max(y_coords_all) and x == max(x_coords_all):
+        return "bottom_right_filter"
+    elif y == min(y_coords_all):
+        return "left_filter"
+    elif y == max(y_coords_all):
+        return "right_filter"
+    elif x == min(x_coords_all):
+        return "top_filter"
+    elif x == max(x_coords_all):
+        return "bottom_filter"
+    else:
+        return "filter"
+
+
+def tile_resolution(shape, M, N, resolution):
+    # each tile runs at its own size instead of being stretched up to the resolution
+    # of the whole image, which is what made every tile cost as much as a full image.
+    # a precision above 1.0 still carries over to the tiles, and the resolution of the
+    # whole image is the most the tiles ever use since that is known to fit in memory
+    scale = max(resolution[0] / shape[1], resolution[1] / shape[0], 1.0)
+    width = min(int(round(N * scale)), int(round(resolution[0])))
+    height = min(int(round(M * scale)), int(round(resolution[1])))
+    return width, height
+
+
+def infer_tiles(config, crops, width, height):
+    # the tiles are all the same size, so they go through the model in batches the same
+    # way the images themselves do. the model is only resized, never reloaded
+    batch_size = TILE_BATCH_SIZES.get((width, height), config.get("tile-batch-size", 8))
+
+    depths = []
+    while len(depths) < len(crops):
+        batch = crops[len(depths) : len(depths) + batch_size]
+        try:
+            model = autovrai.model_loader(config, width, height, 1.0)
+            depths.extend(autovrai.model_infer(model, batch))
+        except RuntimeError as e:
+            if "out of memory" not in str(e) and "can't allocate memory" not in str(e):
+                raise e
+            if batch_size <= 1:
+                raise e
+
+            autovrai.cleanup()
+            batch_size = batch_size // 2
+            print(
+                "--- AutoVR.ai ---",
+                f"Retrying the tiles with a smaller (tile-batch-size: {batch_size})...",
+            )
+
+    # the next image with the same tiles starts out at the batch size that worked
+    TILE_BATCH_SIZES[(width, height)] = batch_size
+    return depths
+
+
 def apply_filters(
-    model, im, filters, tile_sizes, low_res_scaled_depth, save_tiled_depth_map
+    config,
+    name,
+    im,
+    filters,
+    tile_sizes,
+    low_res_scaled_depth,
+    resolution,
+    timings,
 ):
+    schedules = [tile_schedule(im.shape, tile_size) for tile_size in tile_sizes]
+
+    with timed(timings, "statistics"):
+        statistics = tile_statistics(low_res_scaled_depth, schedules)
+
     compiled_tiles_list = []
-    for i in range(len(filters)):
-        num_x = tile_sizes[i][0]
-        num_y = tile_sizes[i][1]
+    for i, (M, N, tiles) in enumerate(schedules):
+        width, height = tile_resolution(im.shape, M, N, resolution)
 
-        M = im.shape[0] // num_x
-        N = im.shape[1] // num_y
+        with timed(timings, "cropping"):
+            crops = [
+                Image.fromarray(np.uint8(im[x : x + M, y : y + N])) for x, y, _ in tiles
+            ]
 
-        compiled_tiles = np.zeros((im.shape[0], im.shape[1]))
+        with timed(timings, "inference"):
+            depths = infer_tiles(config, crops, width, height)
 
-        x_coords = list(range(0, im.shape[0], im.shape[0] // num_x))[:num_x]
-        y_coords = list(range(0, im.shape[1], im.shape[1] // num_y))[:num_y]
+        with timed(timings, "blending"):
+            compiled_tiles = blend_tiles(
+                im.shape, M, N, tiles, depths, filters[i], statistics[i]
+            )
+            compiled_tiles_list.append(compiled_tiles)
+
+        autovrai.save_debug_image(
+            config,
+            name,
+            f"tiled_depth_{i}.png",
+            lambda values=compiled_tiles: Image.fromarray(
+                (2**16 * 0.999 * values / np.max(values)).astype("uint16")
+            ),
+        )
 
-        x_coords_between = list(
-            range((im.shape[0] // num_x) // 2, im.shape[0], im.shape[0] // num_x)
-        )[: num_x - 1]
-        y_coords_between = list(
-            range((im.shape[1] // num_y) // 2, im.shape[1], im.shape[1] // num_y)
-        )[: num_y - 1]
+    return compiled_tiles_list
 
-        x_coords_all = x_coords + x_coords_between
-        y_coords_all = y_coords + y_coords_between
 
-        autovrai.print_current_datetime(
-            f"Starting tiles for filter {i} of {len(filters)}"
+def tile_statistics(values, schedules):
+    # the mean and standard deviation of `values` under every tile of every schedule,
+    # from a single pass over the image. the image is cut up along every edge of every
+    # tile, the sum and the sum of squares of each of those cells is added up once, and
+    # any tile is then just four lookups into the running totals of the cells
+    height, width = values.shape
+    rows = sorted(
+        {b for M, _, tiles in schedules for x, _, _ in tiles for b in (x, x + M)}
+    )
+    cols = sorted(
+        {b for _, N, tiles in schedules for _, y, _ in tiles for b in (y, y + N)}
+    )
+    rows = [0] + [b for b in rows if 0 < b < height]
+    cols = [0] + [b for b in cols if 0 < b < width]
+
+    sums = np.zeros((len(rows) + 1, len(cols) + 1))
+    squares = np.zeros((len(rows) + 1, len(cols) + 1))
+    for k, start in enumerate(rows):
+        end = rows[k + 1] if k + 1 < len(rows) else height
+
+        # one strip of cells at a time, so only a strip is ever held as float64
+        strip = values[start:end].astype(np.float64)
+        sums[k + 1, 1:] = np.add.reduceat(strip.sum(axis=0), cols)
+        strip *= strip
+        squares[k + 1, 1:] = np.add.reduceat(strip.sum(axis=0), cols)
+
+    sums = sums.cumsum(axis=0).cumsum(axis=1)
+    squares = squares.cumsum(axis=0).cumsum(axis=1)
+
+    row_index = {b: k for k, b in enumerate(rows + [height])}
+    col_index = {b: k for k, b in enumerate(cols + [width])}
+
+    statistics = []
+    for M, N, tiles in schedules:
+        r0 = np.array([row_index[x] for x, _, _ in tiles])
+        r1 = np.array([row_index[x + M] for x, _, _ in tiles])
+        c0 = np.array([col_index[y] for _, y, _ in tiles])
+        c1 = np.array([col_index[y + N] for _, y, _ in tiles])
+
+        count = M * N
+        total = sums[r1, c1] - sums[r0, c1] - sums[r1, c0] + sums[r0, c0]
+        total_squares = (
+            squares[r1, c1] - squares[r0, c1] - squares[r1, c0] + squares[r0, c0]
         )
-        print("--- AutoVR.ai ---", "x_coords_all:", x_coords_all)
-        print("--- AutoVR.ai ---", "y_coords_all:", y_coords_all)
-
-        for x in x_coords_all:
-            for y in y_coords_all:
-                autovrai.print_current_datetime(f"Starting tile {x} {y}")
-
-                depth = model.infer_pil(
-                    Image.fromarray(np.uint8(im[x : x + M, y : y + N]))
-                )
-
-                scaled_depth = 2**16 - (depth - np.min(depth)) * 2**16 / (
-                    np.max(depth) - np.min(depth)
-                )
-
-                if y == min(y_coords_all) and x == min(x_coords_all):
-                    selected_filter = filters[i]["top_left_filter"]
-                elif y == min(y_coords_all) and x == max(x_coords_all):
-                    selected_filter = filters[i]["bottom_left_filter"]
-                elif y == max(y_coords_all) and x == min(x_coords_all):
-                    selected_filter = filters[i]["top_right_filter"]
-                elif y == max(y_coords_all) and x == max(x_coords_all):
-                    selected_filter = filters[i]["bottom_right_filter"]
-                elif y == min(y_coords_all):
-                    selected_filter = filters[i]["left_filter"]
-                elif y == max(y_coords_all):
-                    selected_filter = filters[i]["right_filter"]
-                elif x == min(x_coords_all):
-                    selected_filter = filters[i]["top_filter"]
-                elif x == max(x_coords_all):
-                    selected_filter = filters[i]["bottom_filter"]
-                else:
-                    selected_filter = filters[i]["filter"]
-
-                compiled_tiles[x : x + M, y : y + N] += selected_filter * (
-                    np.mean(low_res_scaled_depth[x : x + M, y : y + N])
-                    + np.std(low_res_scaled_depth[x : x + M, y : y + N])
-                    * ((scaled_depth - np.mean(scaled_depth)) / np.std(scaled_depth))
-                )
-
-        compiled_tiles[compiled_tiles < 0] = 0
-        compiled_tiles_list.append(compiled_tiles)
-
-        if save_tiled_depth_map:
-            tiled_depth_map = Image.fromarray(
-                (2**16 * 0.999 * compiled_tiles / np.max(compiled_tiles)).astype(
-                    "uint16"
-                )
-            )
-            tiled_depth_map.save(os.path.join("combined", f"tiled_depth_{i}.png"))
+        mean = total / count
+        std = np.sqrt(np.maximum(total_squares / count - mean**2, 0.0))
+        statistics.append(np.stack([mean, std], axis=1))
 
-    return compiled_tiles_list
+    return statistics
+
+
+def blend_tiles(shape, M, N, tiles, depths, filters, statistics):
+    # every tile's depth is normalized and then stretched to match the mean and spread
+    # of the low res depth under it, before being faded in with its filter. all of it
+    # happens in float32 in one reused buffer, and is added straight into the result
+    compiled_tiles = np.zeros(shape[:2], dtype=np.float32)
+    buffer = np.empty((M, N), dtype=np.float32)
+
+    for (x, y, name), depth, (mean, std) in zip(tiles, depths, statistics):
+        centered = np.subtract(
+            depth, depth.mean(dtype=np.float64), out=buffer, casting="unsafe"
+        )
+        flat = centered.ravel()
+        spread = np.sqrt(np.dot(flat, flat) / flat.size)
 
+        # the model gives the distance, where the scaled depth is the other way around
+        # (closer is higher), so the normalized depth is flipped. a completely flat
+        # tile has nothing to stretch and just takes on the mean
+        scale = -std / spread if spread > 0 else 0.0
 
-def combine_depthmaps(im, compiled_tiles_list, low_res_scaled_depth):
-    save_mask_image = False
+        centered *= scale
+        centered += mean
+        centered *= filters[name]
+        compiled_tiles[x : x + M, y : y + N] += centered
 
-    grey_im = np.mean(im, axis=2)
+    np.maximum(compiled_tiles, 0, out=compiled_tiles)
+    return compiled_tiles
 
-    tiles_blur = gaussian_filter(grey_im, sigma=20)
+
+def blend_mask(config, im):
+    # where the image has fine detail the tiles are trusted more than the low res depth
+    fast = config.get("tile-blur", "exact") == "fast"
+    grey_im = np.mean(im, axis=2, dtype=np.float32 if fast else None)
+
+    tiles_blur = blur(grey_im, 20, fast)
     tiles_difference = tiles_blur - grey_im
 
     # np.clip(tiles_difference, 0,  np.max(tiles_difference))
     tiles_difference = tiles_difference / np.max(tiles_difference)
-    tiles_difference = gaussian_filter(tiles_difference, sigma=40)
+    tiles_difference = blur(tiles_difference, 40, fast)
     tiles_difference *= 5
     tiles_difference = np.clip(tiles_difference, 0, 0.999)
 
-    if save_mask_image:
-        mask_image = Image.fromarray((tiles_difference * 2**16).astype("uint16"))
-        mask_image.save(os.path.join("combined", "mask_image.png"))
+    return tiles_difference
+
+
+def blur(values, sigma, fast):
+    if not fast:
+        return gaussian_filter(values, sigma=sigma)
+
+    # opencv is only imported when it is actually used, it is slow to import
+    import cv2
+
+    # the result of a blur this wide is smooth, so most of it can be done on a smaller
+    # copy of the image and scaled back up. shrinking by averaging and growing back
+    # with bilinear interpolation blur a little on their own, about k/2 pixels worth,
+    # which is taken off of the blur that is done at the smaller size
+    k = max(int(sigma // 8), 1)
+    height, width = values.shape
+    size = (max(round(width / k), 1), max(round(height / k), 1))
+
+    small = cv2.resize(values, size, interpolation=cv2.INTER_AREA)
+    small_sigma = math.sqrt(sigma**2 - k**2 / 4) / k
+    small = cv2.GaussianBlur(small, (0, 0), small_sigma, borderType=cv2.BORDER_REFLECT)
+    return cv2.resize(small, (width, height), interpolation=cv2.INTER_LINEAR)
+
+
+def combine_depthmaps(config, name, im, compiled_tiles_list, low_res_scaled_depth):
+    tiles_difference = blend_mask(config, im)
+
+    autovrai.save_debug_image(
+        config,
+        name,
+        "mask_image.png",
+        lambda: Image.fromarray((tiles_difference * 2**16).astype("uint16")),
+    )
 
     combined_result = (
         tiles_difference * compiled_tiles_list[1]
@@ -1,15 +1,20 @@
 import os
 import re
 import ast
-import cv2
 import sys
+import zlib
 import glob
-import torch
+import shutil
 import socket
+import struct
 import logging
 import datetime
 import warnings
+import subprocess
+import threading
+import numpy as np
 from PIL import Image
+from collections import namedtuple
 from contextlib import contextmanager
 
 
@@ -43,32 +48,61 @@ def suppress_output():
 
 warnings.filterwarnings("ignore", category=UserWarning, module="torch.hub", lineno=286)
 
-zoedepth_dir = os.path.join(torch.hub.get_dir(), "isl-org_ZoeDepth_main")
 
-if not os.path.exists(zoedepth_dir):
-    print(
-        "--- AutoVR.ai ---",
-        "Did not find the torch.hub cached version of the "
-        "ZoeDepth code, downloading now...",
-    )
-    with suppress_output():
-        torch.hub.help("isl-org/ZoeDepth", "ZoeD_NK", force_reload=True)
+def zoedepth_misc():
+    # the ZoeDepth code is only imported when it is first needed. it comes from the
+    # model registry snapshot when there is one (see `add_registry_paths`), otherwise
+    # from the torch hub cache, and it is only downloaded if neither of those exist
+    try:
+        # ~/.cache/torch/hub/isl-org_ZoeDepth_main/zoedepth/utils/misc.py
+        from zoedepth.utils import misc
+
+        return misc
+    except ImportError:
+        pass
+
+    # torch is only needed here to find the hub cache, so it isn't imported up front
+    import torch
+
+    zoedepth_dir = os.path.join(torch.hub.get_dir(), "isl-org_ZoeDepth_main")
+
+    if not os.path.exists(zoedepth_dir):
+        print(
+            "--- AutoVR.ai ---",
+            "Did not find the torch.hub cached version of the "
+            "ZoeDepth code, downloading now...",
+        )
+        with suppress_output():
+            torch.hub.help("isl-org/ZoeDepth", "ZoeD_NK", force_reload=True)
 
-# Append the path to the ZoeDepth code in the cache directory to sys.path
-sys.path.append(zoedepth_dir)
+    # Append the path to the ZoeDepth code in the cache directory to sys.path
+    sys.path.append(zoedepth_dir)
 
-# Now we can import the utility functions from here:
-# ~/.cache/torch/hub/isl-org_ZoeDepth_main/zoedepth/utils/misc.py
-from zoedepth.utils.misc import save_raw_16bit, colorize
+    from zoedepth.utils import misc
+
+    return misc
 
 
 def colorize_depthmap(depth):
-    return colorize(depth, cmap="gray_r")
+    return zoedepth_misc().colorize(depth, cmap="gray_r")
 
 
 def save_depthraw(depth, filepath):
     with suppress_output():
-        save_raw_16bit(depth, filepath)
+        zoedepth_misc().save_raw_16bit(depth, filepath)
+
+
+def load_depthraw(filepath):
+    # reverses `save_raw_16bit`, which stores the depth multiplied by 256 as uint16
+    with Image.open(filepath) as image:
+        return np.asarray(image, dtype=np.float32) / 256.0
+
+
+def load_depthmap(filepath):
+    # the depthmaps are colorized with the reversed grayscale colormap, so brighter is
+    # closer. only the relative depth can be recovered, but that is all stereo needs
+    with Image.open(filepath) as image:
+        return (255.0 - np.asarray(image.convert("L"), dtype=np.float32)) / 255.0
 
 
 ###### Special imports for ZoeDepth utilities from the torch.hub cache directory. ######
@@ -107,11 +141,20 @@ def load_image(filename):
     return image
 
 
+def read_image_size(filename):
+    # only the header is read here, the actual pixel data is not decoded
+    with Image.open(filename) as image:
+        return image.size
+
+
 def load_video(filename):
     # Check if file exists
     if not os.path.exists(filename):
         raise FileNotFoundError(f"Video file does not exist: {filename}")
 
+    # opencv is only imported when a video is actually used, it is slow to import
+    import cv2
+
     # Load the video
     video = cv2.VideoCapture(filename)
 
@@ -122,6 +165,291 @@ def load_video(filename):
     return video
 
 
+def get_video_info(video):
+    import cv2
+
+    fps = video.get(cv2.CAP_PROP_FPS)
+    count = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+    width = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    VideoInfo = namedtuple("VideoInfo", ["fps", "count", "width", "height"])
+    return VideoInfo(fps, count, width, height)
+
+
+def read_video_frames(video):
+    # decodes one frame at a time straight from the capture, opencv gives us BGR so
+    # it gets flipped to RGB to match what we would have gotten from a PIL image file
+    import cv2
+
+    while True:
+        ret, frame = video.read()
+        if not ret:
+            break
+        yield Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+
+    video.release()
+
+
+def find_ffmpeg():
+    # moviepy already pulls in imageio-ffmpeg which ships its own ffmpeg binary, but
+    # we'll happily use one from the PATH if that isn't available for some reason
+    try:
+        import imageio_ffmpeg
+
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except (ImportError, RuntimeError):
+        pass
+
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        raise FileNotFoundError(
+            "Could not find ffmpeg. Install imageio-ffmpeg or add ffmpeg to the PATH."
+        )
+    return ffmpeg
+
+
+# the output videos keep the extension of their source, so the codecs have to be ones
+# that container can hold. anything not listed here gets h264 and aac, which mp4, mkv,
+# mov and avi all accept
+VIDEO_CODECS = {
+    ".webm": (["-c:v", "libvpx-vp9", "-crf", "32", "-b:v", "0"], "libopus"),
+    ".ogv": (["-c:v", "libtheora", "-q:v", "7"], "libvorbis"),
+    ".ogg": (["-c:v", "libtheora", "-q:v", "7"], "libvorbis"),
+}
+DEFAULT_VIDEO_CODECS = (["-c:v", "libx264"], "aac")
+
+
+def open_video_writer(filename, width, height, fps, audio_source=None):
+    # raw RGB frames get piped directly into ffmpeg's stdin, so nothing is written to
+    # disk except the final video. the audio (if there is any) is copied over from the
+    # source video and muxed in while encoding, the `?` makes the audio map optional
+    extension = os.path.splitext(filename)[1].lower()
+    video_codec, audio_codec = VIDEO_CODECS.get(extension, DEFAULT_VIDEO_CODECS)
+
+    command = [
+        find_ffmpeg(),
+        "-y",
+        "-loglevel",
+        "error",
+        "-f",
+        "rawvideo",
+        "-pix_fmt",
+        "rgb24",
+        "-s",
+        f"{width}x{height}",
+        "-r",
+        str(fps),
+        "-i",
+        "-",
+    ]
+    if audio_source is not None:
+        command += ["-i", audio_source, "-map", "0:v:0", "-map", "1:a:0?"]
+        command += ["-c:a", audio_codec, "-shortest"]
+
+    # yuv420p needs even dimensions, so pad by a pixel when needed
+    command += ["-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", *video_codec]
+    command += ["-pix_fmt", "yuv420p", filename]
+
+    return subprocess.Popen(command, stdin=subprocess.PIPE)
+
+
+def write_video_frame(writer, frame):
+    # accepts either a PIL image or a numpy array, anything with an alpha channel
+    # (like the colorized depthmaps) gets flattened down to RGB first
+    if isinstance(frame, Image.Image):
+        frame = frame.convert("RGB")
+    elif frame.ndim == 3 and frame.shape[2] == 4:
+        frame = frame[:, :, :3]
+    writer.stdin.write(np.ascontiguousarray(frame, dtype=np.uint8).tobytes())
+
+
+def close_video_writer(writer):
+    try:
+        writer.stdin.close()
+    except BrokenPipeError:
+        # ffmpeg already exited, the wait below picks up why
+        pass
+    if writer.wait() != 0:
+        raise RuntimeError(f"ffmpeg exited with an error: {writer.returncode}")
+
+
+# the memory mapped canvases of the image writers always have four channels, that way
+# PIL can use them directly instead of making its own copy. jpegs can be saved straight
+# from RGBX, the other formats need the padding channel dropped first
+CANVAS_MODES = {3: "RGBX", 4: "RGBA"}
+
+
+def open_image_writer(filename, width, height, channels=3, canvas=False):
+    # the rows of an image are written a band at a time, so a very large output never
+    # needs to be in memory all at once. pngs are encoded as the rows come in, anything
+    # else is put together in a memory mapped file next to the output (which the OS can
+    # page out as needed) and encoded from there once every row has been written.
+    #
+    # with `canvas` there is always a canvas, in writer["canvas"], and it is filled in
+    # directly instead of with `write_image_rows`. that way the outputs can be made
+    # right where they'll be saved from, pngs are then encoded when it's closed.
+    #
+    # everything is written to a temporary file that only replaces the output once
+    # it's complete, so anyone writing the same output at the same time (like a farm
+    # worker whose lease was handed out again) never ends up with a mix of the two
+    temporary = f"{filename}.{os.getpid()}.{threading.get_ident()}"
+    writer = {
+        "filename": filename,
+        "partial": f"{temporary}.part",
+        "width": width,
+        "height": height,
+        "channels": channels,
+        "row": height if canvas else 0,
+    }
+
+    if os.path.splitext(filename)[1].lower() == ".png":
+        writer["file"] = open(writer["partial"], "wb")
+        writer["compressor"] = zlib.compressobj(6)
+        writer["previous"] = np.zeros(width * channels, dtype=np.uint8)
+
+        # 8 bits per channel, RGB or RGBA, no interlacing
+        color_type = {3: 2, 4: 6}[channels]
+        writer["file"].write(b"\x89PNG\r\n\x1a\n")
+        write_png_chunk(
+            writer["file"],
+            b"IHDR",
+            struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0),
+        )
+    if canvas or "file" not in writer:
+        writer["canvas_path"] = f"{temporary}.tmp"
+        writer["canvas"] = np.memmap(
+            writer["canvas_path"], dtype=np.uint8, mode="w+", shape=(height, width, 4)
+        )
+
+    return writer
+
+
+def write_image_rows(writer, rows):
+    # accepts either a PIL image or a numpy array with the next rows of the image
+    if isinstance(rows, Image.Image):
+        rows = np.asarray(rows)
+    if rows.shape[1:] != (writer["width"], writer["channels"]):
+        raise ValueError(
+            f"Expected rows of {writer['width']}x{writer['channels']}, "
+            f"got {rows.shape[1]}x{rows.shape[2]}"
+        )
+    if len(rows) == 0:
+        # a band of a padded image can fall completely outside of it
+        return
+    if writer["row"] + len(rows) > writer["height"]:
+        raise ValueError(f"More rows than the {writer['height']} of the image")
+
+    if "canvas" in writer:
+        top = writer["row"]
+        writer["canvas"][top : top + len(rows), :, : writer["channels"]] = rows
+    else:
+        encode_png_rows(writer, rows)
+
+    writer["row"] += len(rows)
+
+
+def close_image_writer(writer):
+    if writer["row"] != writer["height"]:
+        discard_image_writer(writer)
+        raise ValueError(
+            f"Only {writer['row']} of the {writer['height']} rows of "
+            f"{writer['filename']} were written"
+        )
+
+    if "file" in writer:
+        if "canvas" in writer:
+            encode_png_rows(writer, writer["canvas"][:, :, : writer["channels"]])
+        write_png_chunk(writer["file"], b"IDAT", writer["compressor"].flush())
+        write_png_chunk(writer["file"], b"IEND", b"")
+        writer["file"].close()
+    else:
+        mode = CANVAS_MODES[writer["channels"]]
+        size = (writer["width"], writer["height"])
+        image = Image.frombuffer(mode, size, writer["canvas"], "raw", mode, 0, 1)
+        extension = os.path.splitext(writer["filename"])[1].lower()
+        if mode == "RGBX" and extension not in [".jpg", ".jpeg"]:
+            image = image.convert("RGB")
+        image.save(writer["partial"], format=Image.registered_extensions()[extension])
+        del image
+
+    os.replace(writer["partial"], writer["filename"])
+    discard_image_writer(writer)
+
+
+def discard_image_writer(writer):
+    # cleans up after a writer that won't be finished, including the partial output
+    if "file" in writer:
+        writer["file"].close()
+    if "canvas" in writer:
+        del writer["canvas"]
+        os.remove(writer["canvas_path"])
+    if os.path.exists(writer["partial"]):
+        os.remove(writer["partial"])
+
+
+def encode_png_rows(writer, rows):
+    # filtering a few rows at a time keeps the temporary arrays small, the rows can be
+    # any view (like the first three channels of a canvas) since only those few rows
+    # are ever copied
+    for start in range(0, len(rows), 16):
+        chunk = rows[start : start + 16].reshape(
+            -1, writer["width"] * writer["channels"]
+        )
+        data = filter_png_rows(chunk, writer["previous"], writer["channels"])
+        writer["previous"] = chunk[-1].copy()
+        compressed = writer["compressor"].compress(data.tobytes())
+        if compressed:
+            write_png_chunk(writer["file"], b"IDAT", compressed)
+
+
+def write_png_chunk(file, kind, data):
+    file.write(struct.pack(">I", len(data)))
+    file.write(kind)
+    file.write(data)
+    file.write(struct.pack(">I", zlib.crc32(kind + data)))
+
+
+def filter_png_rows(rows, previous, channels):
+    # every row gets whichever of the five png filters leaves it with the smallest sum
+    # of (signed) differences, which is the same heuristic libpng uses. it makes the
+    # rows a lot easier to compress than the raw pixels would be. the filters wrap
+    # around just like uint8 math does, only the paeth predictor needs more range
+    up = np.empty_like(rows)
+    up[0] = previous
+    up[1:] = rows[:-1]
+    left = np.zeros_like(rows)
+    left[:, channels:] = rows[:, :-channels]
+    up_left = np.zeros_like(rows)
+    up_left[:, channels:] = up[:, :-channels]
+
+    a = left.astype(np.int16)
+    b = up.astype(np.int16)
+    c = up_left.astype(np.int16)
+    distance_left = np.abs(b - c)
+    distance_up = np.abs(a - c)
+    distance_up_left = np.abs(a + b - 2 * c)
+    paeth = np.where(
+        (distance_left <= distance_up) & (distance_left <= distance_up_left),
+        left,
+        np.where(distance_up <= distance_up_left, up, up_left),
+    )
+    average = ((a + b) >> 1).astype(np.uint8)
+
+    # none, sub, up, average, paeth (in the order of their png filter types). the
+    # smaller of a byte and its negation is the size of it as a signed byte
+    candidates = [rows, rows - left, rows - up, rows - average, rows - paeth]
+    costs = [np.minimum(d, 0 - d).sum(axis=1, dtype=np.uint32) for d in candidates]
+    chosen = np.argmin(costs, axis=0)
+
+    filtered = np.empty((len(rows), rows.shape[1] + 1), dtype=np.uint8)
+    filtered[:, 0] = chosen
+    for kind, candidate in enumerate(candidates):
+        selected = chosen == kind
+        filtered[selected, 1:] = candidate[selected]
+    return filtered
+
+
 def prep_directories(config):
     # Get the list of directories from the config
     directories = [
@@ -158,16 +486,29 @@ def determine_file_or_path(file_or_path, context):
         )
 
 
-# interprets the values in the standard CUDA memory error message, outputs in GB
+# interprets the values in the standard CUDA memory error message, outputs in GB. the
+# wording of the message has changed between torch versions, so each value is found
+# by what is written around it rather than by the order they show up in
+MEMORY_ERROR_PATTERNS = {
+    "attempted": [r"Tried to allocate {}"],
+    "total": [r"{} total capacity", r"total capacity of {}"],
+    "allocated": [r"{} already allocated", r"{} is allocated by PyTorch"],
+    "free": [r"{} free", r"of which {} is free"],
+    "reserved": [r"{} reserved in total", r"{} is reserved by PyTorch"],
+}
+
+
 def parse_memory_error(message):
     info = {}
-    matches = re.findall(r"(\d+\.\d+)( GiB| MiB)", message)
-    units = {" GiB": 1.074, " MiB": 0.001074}  # Conversion factors to GB
-
-    keys = ["attempted", "total", "allocated", "free", "reserved"]
-    for i, match in enumerate(matches):
-        value, unit = match
-        info[keys[i]] = round(float(value) * units[unit], 2)
+    units = {"GiB": 1.074, "MiB": 0.001074}  # Conversion factors to GB
+
+    for key, patterns in MEMORY_ERROR_PATTERNS.items():
+        for pattern in patterns:
+            match = re.search(pattern.format(r"(\d+(?:\.\d+)?) (GiB|MiB)"), message)
+            if match:
+                value, unit = match.groups()
+                info[key] = round(float(value) * units[unit], 2)
+                break
 
     return info
 
@@ -0,0 +1,218 @@
+import os
+import re
+import glob
+import queue
+import traceback
+import multiprocessing
+
+import autovrai
+
+
+def parse_cpulist(cpulist):
+    # the linux format for a list of cpus, like "0-15,32-47"
+    cores = set()
+    for part in cpulist.strip().split(","):
+        if "-" in part:
+            first, last = part.split("-")
+            cores.update(range(int(first), int(last) + 1))
+        elif part:
+            cores.add(int(part))
+    return cores
+
+
+def numa_nodes():
+    # the cores of each NUMA node (usually one per CPU socket), only available on linux
+    paths = glob.glob("/sys/devices/system/node/node[0-9]*/cpulist")
+    paths.sort(key=lambda path: int(re.search(r"node(\d+)", path).group(1)))
+
+    nodes = []
+    for path in paths:
+        with open(path, "r") as f:
+            nodes.append(parse_cpulist(f.read()))
+    return nodes
+
+
+def worker_layout(config):
+    # decides the device, the cpu cores, and the number of threads for each worker.
+    # the devices are handed out round robin from worker-devices, and the workers are
+    # spread across the NUMA nodes, sharing the cores of the node they end up on
+    count = config.get("process-workers", 0)
+    devices = config.get("worker-devices") or [config["device-name"]]
+    threads = config.get("worker-threads", 0)
+
+    # on systems without cpu affinity the workers just aren't pinned to any cores
+    available = os.sched_getaffinity(0) if hasattr(os, "sched_getaffinity") else None
+    nodes = []
+    if available is not None:
+        nodes = [node & available for node in numa_nodes()]
+        nodes = [node for node in nodes if node] or [available]
+
+    layout = []
+    for index in range(count):
+        device = devices[index % len(devices)]
+        cores = None
+        if nodes:
+            node = index % len(nodes)
+            sharing = list(range(node, count, len(nodes)))
+            ordered = sorted(nodes[node])
+            share = max(len(ordered) // len(sharing), 1)
+            position = sharing.index(index)
+            cores = set(ordered[position * share : (position + 1) * share])
+            cores = cores or set(ordered)
+
+        if threads > 0:
+            worker_threads = threads
+        elif cores is not None:
+            worker_threads = len(cores)
+        else:
+            worker_threads = max((os.cpu_count() or 1) // count, 1)
+
+        layout.append((device, cores, worker_threads))
+
+    return layout
+
+
+def run_worker_pool(config, batches, factors, manifest, fingerprint, report):
+    layout = worker_layout(config)
+    for index, (device, cores, threads) in enumerate(layout):
+        print(
+            "--- AutoVR.ai ---",
+            f"Worker {index} using (device-name: {device}) with {threads} threads"
+            + (f" on cores {sorted(cores)}" if cores else ""),
+        )
+
+    # cuda doesn't survive being forked, so the workers are always started fresh
+    context = multiprocessing.get_context("spawn")
+    tasks = context.Queue()
+    results = context.Queue()
+
+    # every batch goes into one shared queue and the workers take the next one as soon
+    # as they are ready for it, so faster devices end up doing more of the work
+    for batch in batches:
+        tasks.put(batch)
+    for _ in layout:
+        tasks.put(None)
+
+    processes = []
+    environment = os.environ.get("NUMBA_NUM_THREADS")
+    for index, (device, cores, threads) in enumerate(layout):
+        worker_config = {
+            **config,
+            "device-name": device,
+            "factors": factors,
+            "process-workers": 0,
+        }
+        process = context.Process(
+            target=worker_main,
+            args=(
+                index,
+                worker_config,
+                cores,
+                threads,
+                manifest,
+                fingerprint,
+                tasks,
+                results,
+            ),
+            daemon=True,
+        )
+
+        # numba only reads its number of threads once, when it's first imported, and
+        # `numba.set_num_threads` only changes it for the thread that calls it. the
+        # stereo kernels run on the pipeline's threads, so the only way to get all of
+        # them to stick to the worker's cores is for the worker to start out with it
+        os.environ["NUMBA_NUM_THREADS"] = str(threads)
+        try:
+            process.start()
+        finally:
+            if environment is None:
+                del os.environ["NUMBA_NUM_THREADS"]
+            else:
+                os.environ["NUMBA_NUM_THREADS"] = environment
+        processes.append(process)
+
+    factors = dict(factors)
+    finished = set()
+
+    def handle(kind, index, value):
+        if kind == "finished":
+            report(value)
+        elif kind == "factors":
+            factors.update(value)
+        elif kind == "error":
+            raise RuntimeError(f"Worker {index} failed:\n{value}")
+        elif kind == "exit":
+            finished.add(index)
+
+    try:
+        while len(finished) < len(processes):
+            try:
+                handle(*results.get(timeout=1.0))
+                continue
+            except queue.Empty:
+                pass
+
+            # a worker that was killed or crashed hard never sends anything back,
+            # without this we would wait on it forever. one that just finished can have
+            # exited before its last results made it to us though, so everything that
+            # is still on its way is read first
+            exited = [
+                index
+                for index, process in enumerate(processes)
+                if index not in finished and process.exitcode is not None
+            ]
+            if not exited:
+                continue
+            try:
+                while any(index not in finished for index in exited):
+                    handle(*results.get(timeout=1.0))
+            except queue.Empty:
+                pass
+
+            for index in exited:
+                if index not in finished:
+                    raise RuntimeError(
+                        f"Worker {index} exited unexpectedly "
+                        f"(exit code: {processes[index].exitcode})"
+                    )
+    finally:
+        # if we stopped early there can still be batches sitting in the queue, which
+        # would otherwise keep this process from exiting until they are read
+        tasks.cancel_join_thread()
+        for process in processes:
+            if process.is_alive() and len(finished) < len(processes):
+                process.terminate()
+            process.join()
+
+    return factors
+
+
+def worker_main(index, config, cores, threads, manifest, fingerprint, tasks, results):
+    try:
+        # pinning the process before anything starts its threads means every thread
+        # that torch or numba starts later stays on the same cores (and memory node)
+        if cores:
+            os.sched_setaffinity(0, cores)
+
+        import torch
+
+        # numba already got its number of threads from NUMBA_NUM_THREADS
+        torch.set_num_threads(threads)
+
+        autovrai.add_registry_paths(config)
+        autovrai.start_stereo_warmup()
+
+        def report(filepath):
+            results.put(("finished", index, filepath))
+
+        factors = dict(config.get("factors", {}))
+        model = autovrai.run_image_pipeline(
+            config, iter(tasks.get, None), factors, manifest, fingerprint, report
+        )
+        autovrai.model_unloader(model)
+
+        results.put(("factors", index, factors))
+    except BaseException:
+        results.put(("error", index, traceback.format_exc()))
+    finally:
+        results.put(("exit", index, None))
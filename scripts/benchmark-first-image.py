@@ -0,0 +1,77 @@
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+
+# everything is run from the root of the repo, the same way autovrai itself is run
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# runs in a fresh python process, so the only thing carried over between runs is
+# whatever numba has written to its cache directory
+SNIPPET = """
+import json, time
+import numpy as np
+from PIL import Image
+
+start = time.perf_counter()
+import autovrai.stereo as stereo
+imported = time.perf_counter()
+
+rng = np.random.default_rng(0)
+image = Image.fromarray(rng.integers(0, 256, ({height}, {width}, 3), dtype=np.uint8))
+depth = rng.random(({height}, {width}), dtype=np.float32)
+
+first = time.perf_counter()
+stereo.stereo_eyes(image, depth, 1.25)
+second = time.perf_counter()
+stereo.stereo_eyes(image, depth, 1.25)
+done = time.perf_counter()
+
+print(json.dumps({{
+    "import": imported - start,
+    "first": second - first,
+    "steady": done - second,
+}}))
+"""
+
+
+def run(cache, width, height):
+    result = subprocess.run(
+        [sys.executable, "-c", SNIPPET.format(width=width, height=height)],
+        cwd=ROOT,
+        env={**os.environ, "NUMBA_CACHE_DIR": cache},
+        capture_output=True,
+        check=True,
+    )
+    return json.loads(result.stdout.decode().strip().splitlines()[-1])
+
+
+def main(args):
+    print(f"Image: {args.width}x{args.height}")
+    print(f"{'':<6} {'import':>9} {'1st image':>10} {'2nd image':>10}")
+
+    # the first run starts with an empty cache, like a brand new machine or install,
+    # every run after that should be loading the kernels from the cache instead
+    with tempfile.TemporaryDirectory() as cache:
+        for i in range(1 + args.repeats):
+            times = run(cache, args.width, args.height)
+            print(
+                f"{'cold' if i == 0 else 'warm':<6} "
+                f"{times['import']:>8.2f}s "
+                f"{times['first']:>9.3f}s "
+                f"{times['steady']:>9.3f}s"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measures the first image latency of the stereo kernels with an "
+        "empty numba cache (cold) and with the kernels already cached (warm)."
+    )
+    parser.add_argument("--width", type=int, default=1920, help="Default: 1920")
+    parser.add_argument("--height", type=int, default=1080, help="Default: 1080")
+    parser.add_argument("--repeats", type=int, default=2, help="Default: 2")
+
+    main(parser.parse_args())
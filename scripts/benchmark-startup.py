@@ -0,0 +1,129 @@
+import os
+import sys
+import json
+import shutil
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+import numpy as np
+from PIL import Image
+
+# everything is run from the root of the repo, the same way autovrai itself is run
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# each of these runs in a brand new interpreter, so every import is a cold import
+COMMANDS = {
+    "import autovrai": ["-c", "import autovrai"],
+    "autovrai --help": ["autovrai", "--help"],
+    "autovrai.config": ["-c", "import autovrai.config"],
+    "autovrai.utilities": ["-c", "import autovrai.utilities"],
+    "autovrai.process": ["-c", "import autovrai.process"],
+    "autovrai.stereo": ["-c", "import autovrai.stereo"],
+    "autovrai.model": ["-c", "import autovrai.model"],
+    "autovrai.gui": ["-c", "import autovrai.gui"],
+}
+
+# runs the cli the same way `python autovrai` does, and fails if torch was imported
+RUN_WITHOUT_TORCH = (
+    "import sys, runpy; sys.argv = ['autovrai', *sys.argv[1:]]; "
+    "runpy.run_path('autovrai', run_name='__main__'); "
+    "sys.exit('torch was imported' if 'torch' in sys.modules else 0)"
+)
+
+
+def processing_runs(directory):
+    # whole processing runs that never need the model, one where every image already
+    # has a depth to reuse and one where every image was already finished. neither of
+    # them should ever import torch
+    for folder in ["input", "depthraw"]:
+        os.makedirs(os.path.join(directory, folder))
+    image = np.random.randint(0, 256, (480, 640, 3), dtype=np.uint8)
+    Image.fromarray(image).save(os.path.join(directory, "input", "image.png"))
+    depth = np.random.randint(256, 2560, (480, 640), dtype=np.uint16)
+    Image.fromarray(depth).save(os.path.join(directory, "depthraw", "image.png"))
+
+    arguments = ["-c", RUN_WITHOUT_TORCH]
+    arguments += ["--input-source", os.path.join(directory, "input")]
+    arguments += ["--input-depthraw", os.path.join(directory, "depthraw")]
+    arguments += ["--precision-mode", "manual", "--debug-directory", ""]
+    for key in ["cache-directory", "model-directory", "output-stereo"]:
+        arguments += [f"--{key}", os.path.join(directory, key)]
+    for key in ["padded", "anaglyph", "depthmap", "depthraw"]:
+        arguments += [f"--output-{key}", ""]
+
+    return {
+        "run (input depths)": arguments,
+        "run (resumed)": [*arguments, "--resume"],
+    }
+
+
+def measure(arguments, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, *arguments],
+            cwd=ROOT,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+        elapsed = time.perf_counter() - start
+        if result.returncode != 0:
+            # usually an optional dependency that isn't installed here
+            return None, result.stderr.decode().strip().splitlines()[-1]
+        times.append(elapsed)
+    return times, None
+
+
+def main(args):
+    print(f"Python {sys.version.split()[0]}, {args.repeats} cold runs each")
+    print(f"{'command':<24} {'min':>8} {'median':>8}")
+
+    directory = tempfile.mkdtemp()
+    runs = processing_runs(directory)
+    # the first run finishes the image, so the resumed run has nothing left to do
+    measure(runs["run (input depths)"], 1)
+
+    failed = False
+    results = {}
+    for name, arguments in {**COMMANDS, **runs}.items():
+        times, error = measure(arguments, args.repeats)
+        if times is None and name in runs and "torch" in error:
+            print(f"{name:<24} {'FAILED':>17}  ({error})")
+            failed = True
+            continue
+        if times is None:
+            print(f"{name:<24} {'unavailable':>17}  ({error})")
+            continue
+
+        results[name] = {"min": min(times), "median": statistics.median(times)}
+        print(
+            f"{name:<24} "
+            f"{results[name]['min'] * 1000:>6.0f}ms "
+            f"{results[name]['median'] * 1000:>6.0f}ms"
+        )
+
+    # appended as one line per run, so the cost can be tracked across changes
+    if args.output:
+        with open(args.output, "a") as f:
+            record = {"time": time.time(), "python": sys.version, "results": results}
+            f.write(json.dumps(record) + "\n")
+
+    shutil.rmtree(directory)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measures the cold start time of importing autovrai and its "
+        "modules, and of processing runs that never need the model, each in a fresh "
+        "python process. Fails if either of those runs imports torch."
+    )
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument(
+        "--output", default="", help="Append the results as a json line to this file."
+    )
+
+    main(parser.parse_args())
@@ -0,0 +1,276 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from PIL import Image
+from numba import njit, prange, get_num_threads
+from scipy.ndimage import gaussian_filter
+
+# makes the autovrai package importable when running this from the scripts directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from autovrai.stereo import apply_stereo_divergence_polylines, stereo_eyes
+
+
+# this is an untouched copy of the original polylines kernel, it is only kept around
+# as the reference that the current version must match pixel for pixel
+@njit(parallel=True)
+def reference_polylines(
+    original_image, normalized_depth, divergence_px: float, fill_technique
+):
+    # This code treats rows of the image as polylines
+    # It generates polylines, morphs them (applies divergence) to them, and then rasterizes them
+    EPSILON = 1e-7
+    PIXEL_HALF_WIDTH = 0.45 if fill_technique == "polylines_sharp" else 0.0
+    # PERF_COUNTERS = [0, 0, 0]
+
+    h, w, c = original_image.shape
+    derived_image = np.zeros_like(original_image)
+    for row in prange(h):
+        # generating the vertices of the morphed polyline
+        # format: new coordinate of the vertex, divergence (closeness), column of pixel that contains the point's color
+        pt = np.zeros((5 + 2 * w, 3), dtype=np.float_)
+        pt_end: int = 0
+        pt[pt_end] = [-3.0 * abs(divergence_px), 0.0, 0.0]
+        pt_end += 1
+        for col in range(0, w):
+            coord_d = (1 - normalized_depth[row][col] ** 2) * divergence_px
+            coord_x = col + 0.5 + coord_d
+            if PIXEL_HALF_WIDTH < EPSILON:
+                pt[pt_end] = [coord_x, abs(coord_d), col]
+                pt_end += 1
+            else:
+                pt[pt_end] = [coord_x - PIXEL_HALF_WIDTH, abs(coord_d), col]
+                pt[pt_end + 1] = [coord_x + PIXEL_HALF_WIDTH, abs(coord_d), col]
+                pt_end += 2
+        pt[pt_end] = [w + 3.0 * abs(divergence_px), 0.0, w - 1]
+        pt_end += 1
+
+        # generating the segments of the morphed polyline
+        # format: coord_x, coord_d, color_i of the first point, then the same for the second point
+        sg_end: int = pt_end - 1
+        sg = np.zeros((sg_end, 6), dtype=np.float_)
+        for i in range(sg_end):
+            sg[i] += np.concatenate((pt[i], pt[i + 1]))
+        # Here is an informal proof that this (morphed) polyline does not self-intersect:
+        # Draw a plot with two axes: coord_x and coord_d. Now draw the original line - it will be positioned at the
+        # bottom of the graph (that is, for every point coord_d == 0). Now draw the morphed line using the vertices of
+        # the original polyline. Observe that for each vertex in the new polyline, its increments
+        # (from the corresponding vertex in the old polyline) over coord_x and coord_d are in direct proportion.
+        # In fact, this proportion is equal for all the vertices and it is equal either -1 or +1,
+        # depending on the sign of divergence_px. Now draw the lines from each old vertex to a corresponding new vertex.
+        # Since the proportions are equal, these lines have the same angle with an axe and are parallel.
+        # So, these lines do not intersect. Now rotate the plot by 45 or -45 degrees and observe that
+        # each dot of the polyline is further right from the last dot,
+        # which makes it impossible for the polyline to self-interset. QED.
+
+        # sort segments and points using insertion sort
+        # has a very good performance in practice, since these are almost sorted to begin with
+        for i in range(1, sg_end):
+            u = i - 1
+            while pt[u][0] > pt[u + 1][0] and 0 <= u:
+                pt[u], pt[u + 1] = np.copy(pt[u + 1]), np.copy(pt[u])
+                sg[u], sg[u + 1] = np.copy(sg[u + 1]), np.copy(sg[u])
+                u -= 1
+
+        # rasterizing
+        # at each point in time we keep track of segments that are "active" (or "current")
+        csg = np.zeros((5 * int(abs(divergence_px)) + 25, 6), dtype=np.float_)
+        csg_end: int = 0
+        sg_pointer: int = 0
+        # and index of the point that should be processed next
+        pt_i: int = 0
+        for col in range(
+            w
+        ):  # iterate over regions (that will be rasterizeed into pixels)
+            color = np.full(
+                c, 0.5, dtype=np.float_
+            )  # we start with 0.5 because of how floats are converted to ints
+            while pt[pt_i][0] < col:
+                pt_i += 1
+            pt_i -= 1  # pt_i now points to the dot before the region start
+            # Finding segment' parts that contribute color to the region
+            while pt[pt_i][0] < col + 1:
+                coord_from = max(col, pt[pt_i][0]) + EPSILON
+                coord_to = min(col + 1, pt[pt_i + 1][0]) - EPSILON
+                significance = coord_to - coord_from
+                # the color at center point is the same as the average of color of segment part
+                coord_center = coord_from + 0.5 * significance
+
+                # adding semgents that now may contribute
+                while sg_pointer < sg_end and sg[sg_pointer][0] < coord_center:
+                    csg[csg_end] = sg[sg_pointer]
+                    sg_pointer += 1
+                    csg_end += 1
+                # removing segments that will no longer contribute
+                csg_i = 0
+                while csg_i < csg_end:
+                    if csg[csg_i][3] < coord_center:
+                        csg[csg_i] = csg[csg_end - 1]
+                        csg_end -= 1
+                    else:
+                        csg_i += 1
+                # finding the closest segment (segment with most divergence)
+                # note that this segment will be the closest from coord_from right up to coord_to, since there
+                # no new segments "appearing" inbetween these two and _the polyline does not self-intersect_
+                best_csg_i: int = 0
+                # PERF_COUNTERS[0] += 1
+                if csg_end != 1:
+                    # PERF_COUNTERS[1] += 1
+                    best_csg_closeness: float = -EPSILON
+                    for csg_i in range(csg_end):
+                        ip_k = (coord_center - csg[csg_i][0]) / (
+                            csg[csg_i][3] - csg[csg_i][0]
+                        )
+                        # assert 0.0 <= ip_k <= 1.0
+                        closeness = (1.0 - ip_k) * csg[csg_i][1] + ip_k * csg[csg_i][4]
+                        if best_csg_closeness < closeness and 0.0 < ip_k < 1.0:
+                            best_csg_closeness = closeness
+                            best_csg_i = csg_i
+                # getting the color
+                col_l: int = int(csg[best_csg_i][2] + EPSILON)
+                col_r: int = int(csg[best_csg_i][5] + EPSILON)
+                if col_l == col_r:
+                    color += original_image[row][col_l] * significance
+                else:
+                    # PERF_COUNTERS[2] += 1
+                    ip_k = (coord_center - csg[best_csg_i][0]) / (
+                        csg[best_csg_i][3] - csg[best_csg_i][0]
+                    )
+                    color += (
+                        original_image[row][col_l] * (1.0 - ip_k)
+                        + original_image[row][col_r] * ip_k
+                    ) * significance
+                pt_i += 1
+            derived_image[row][col] = np.asarray(color, dtype=np.uint8)
+    # print(PERF_COUNTERS)
+    return derived_image
+
+
+def generate_inputs(width, height, seed):
+    rng = np.random.default_rng(seed)
+    image = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+    # a blurred noise field is a lot closer to a real depth map than pure noise is
+    depth = gaussian_filter(rng.random((height, width)), sigma=8)
+    depth = (depth - depth.min()) / (depth.max() - depth.min())
+
+    return image, depth
+
+
+def load_inputs(filename):
+    image = np.array(Image.open(filename).convert("RGB"))
+
+    # without a model handy, the brightness works well enough as a stand-in depth
+    depth = gaussian_filter(image.mean(axis=2), sigma=4)
+    depth = (depth - depth.min()) / (depth.max() - depth.min())
+
+    return image, depth
+
+
+def time_kernel(kernel, image, depth, divergence, fill_technique, repeat):
+    # the first call includes the JIT compile, so it is not counted
+    result = kernel(image, depth, divergence, fill_technique)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = kernel(image, depth, divergence, fill_technique)
+    elapsed = (time.perf_counter() - start) / repeat
+
+    return result, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Benchmark the stereo polylines kernel against the original reference "
+            "implementation and make sure the output is pixel-identical."
+        )
+    )
+    parser.add_argument("--image", help="Optional image to use instead of noise.")
+    parser.add_argument("--width", type=int, default=3840, help="Default: 3840")
+    parser.add_argument("--height", type=int, default=2160, help="Default: 2160")
+    parser.add_argument("--intensity", type=float, default=1.25, help="Default: 1.25")
+    parser.add_argument("--repeat", type=int, default=3, help="Default: 3")
+    parser.add_argument("--seed", type=int, default=0, help="Default: 0")
+    args = parser.parse_args()
+
+    if args.image:
+        image, depth = load_inputs(args.image)
+    else:
+        image, depth = generate_inputs(args.width, args.height, args.seed)
+
+    # same divergence calculation as `stereo_eyes` uses
+    divergence = ((args.intensity / 2) / 100.0) * image.shape[1]
+    print(f"Image: {image.shape[1]}x{image.shape[0]}, divergence: {divergence:.2f}px")
+
+    failed = False
+    for fill_technique in ["polylines_sharp", "polylines_soft"]:
+        for sign in [1, -1]:
+            expected, reference_time = time_kernel(
+                reference_polylines,
+                image,
+                depth,
+                divergence * sign,
+                fill_technique,
+                args.repeat,
+            )
+            actual, current_time = time_kernel(
+                lambda *args: apply_stereo_divergence_polylines(
+                    *args, get_num_threads()
+                ),
+                image,
+                depth,
+                divergence * sign,
+                fill_technique,
+                args.repeat,
+            )
+
+            identical = np.array_equal(expected, actual)
+            failed = failed or not identical
+            print(
+                f"{fill_technique:>16} {'left' if sign > 0 else 'right':>5}: "
+                f"reference {reference_time:.3f}s, "
+                f"current {current_time:.3f}s, "
+                f"speedup {reference_time / current_time:.2f}x, "
+                f"{'identical' if identical else 'DIFFERENT'}"
+            )
+
+    # the fused version does both eyes in one pass, it's compared against two calls of
+    # the reference kernel joined together the way the stereo output used to be
+    pil_image = Image.fromarray(image)
+    for fill_technique in ["polylines_sharp", "polylines_soft"]:
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            expected = np.hstack(
+                [
+                    reference_polylines(image, depth, divergence, fill_technique),
+                    reference_polylines(image, depth, -divergence, fill_technique),
+                ]
+            )
+        reference_time = (time.perf_counter() - start) / args.repeat
+
+        stereo_eyes(pil_image, depth, args.intensity, fill_technique)
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            left, right = stereo_eyes(pil_image, depth, args.intensity, fill_technique)
+        current_time = (time.perf_counter() - start) / args.repeat
+
+        identical = np.array_equal(expected, left.base)
+        failed = failed or not identical
+        print(
+            f"{fill_technique:>16} fused: "
+            f"reference {reference_time:.3f}s, "
+            f"current {current_time:.3f}s, "
+            f"speedup {reference_time / current_time:.2f}x, "
+            f"{'identical' if identical else 'DIFFERENT'}"
+        )
+
+    if failed:
+        print("ERROR: The current kernel does not match the reference output.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
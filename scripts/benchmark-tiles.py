@@ -0,0 +1,185 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from PIL import Image
+from scipy.ndimage import gaussian_filter
+
+# makes the autovrai package importable when running this from the scripts directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from autovrai.tiles import (
+    build_filters,
+    tile_schedule,
+    tile_statistics,
+    blend_tiles,
+    blend_mask,
+)
+
+
+# this is a copy of the original per tile blending loop, it is only kept around as the
+# reference that the current version is compared against
+def reference_blend(shape, M, N, tiles, depths, filters, low_res_scaled_depth):
+    compiled_tiles = np.zeros((shape[0], shape[1]))
+
+    for (x, y, name), depth in zip(tiles, depths):
+        scaled_depth = 2**16 - (depth - np.min(depth)) * 2**16 / (
+            np.max(depth) - np.min(depth)
+        )
+
+        selected_filter = filters[name]
+        compiled_tiles[x : x + M, y : y + N] += selected_filter * (
+            np.mean(low_res_scaled_depth[x : x + M, y : y + N])
+            + np.std(low_res_scaled_depth[x : x + M, y : y + N])
+            * ((scaled_depth - np.mean(scaled_depth)) / np.std(scaled_depth))
+        )
+
+    compiled_tiles[compiled_tiles < 0] = 0
+    return compiled_tiles
+
+
+def generate_inputs(width, height, seed):
+    rng = np.random.default_rng(seed)
+
+    # a blurred noise field is a lot closer to a real depth map than pure noise is
+    depth = gaussian_filter(rng.random((height // 4, width // 4)), sigma=4)
+    depth = np.kron(depth, np.ones((4, 4))).astype(np.float32)
+    low_res_scaled_depth = 2**16 - (depth - depth.min()) * 2**16 / (
+        depth.max() - depth.min()
+    )
+
+    return rng, low_res_scaled_depth
+
+
+def generate_image(rng, width, height):
+    # smooth shapes, hard edges, and some noise, the blend mask needs some detail to
+    # find or it would just be flat
+    base = gaussian_filter(rng.random((height // 8, width // 8)), sigma=3)
+    base = np.kron(base, np.ones((8, 8)))
+    edges = (np.sin(np.arange(width) / 37.0)[np.newaxis, :] > 0.3) * 0.5
+    edges = edges + (np.arange(height)[:, np.newaxis] % 200 < 20) * 0.3
+    grey = base * 0.6 + edges + rng.normal(0, 0.05, (height, width))
+    grey = np.clip(grey * 200, 0, 255).astype(np.uint8)
+    return np.repeat(grey[:, :, np.newaxis], 3, axis=2)
+
+
+def compare_blur(im, repeat):
+    # the fast blur is an approximation, this is how far its blend mask is from the
+    # exact one, on the 0 to 1 scale of the mask itself
+    results = {}
+    for mode in ["exact", "fast"]:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            results[mode] = blend_mask({"tile-blur": mode}, im)
+        results[f"{mode} time"] = (time.perf_counter() - start) / repeat
+
+    difference = np.abs(results["fast"] - results["exact"])
+    print(
+        f"  blur      exact {results['exact time']:.3f}s, "
+        f"fast {results['fast time']:.3f}s, "
+        f"speedup {results['exact time'] / results['fast time']:.2f}x, "
+        f"max difference {difference.max():.4f}, "
+        f"mean difference {difference.mean():.5f}"
+    )
+
+
+def tile_depths(rng, M, N, count):
+    # stands in for the model, these only need to be shaped like the real tile depths
+    return [
+        (rng.random((M, N), dtype=np.float32) * 10 + 1).astype(np.float32)
+        for _ in range(count)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Benchmark the tiled-upscale blending (everything except the model itself) "
+            "against the original per tile loop and compare the results."
+        )
+    )
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        default=["3840x2160", "7680x4320"],
+        help="Default: 3840x2160 7680x4320",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Default: 3")
+    parser.add_argument("--seed", type=int, default=0, help="Default: 0")
+    parser.add_argument(
+        "--skip-reference",
+        action="store_true",
+        help="Only time the current version, the reference is slow on 8K images.",
+    )
+    parser.add_argument(
+        "--images",
+        nargs="+",
+        default=[],
+        help="Also compare the tile-blur modes on these images.",
+    )
+    args = parser.parse_args()
+
+    for filename in args.images:
+        im = np.asarray(Image.open(filename).convert("RGB"))
+        print(f"Image: {filename} ({im.shape[1]}x{im.shape[0]})")
+        compare_blur(im, args.repeat)
+
+    for size in args.sizes:
+        width, height = [int(value) for value in size.split("x")]
+        rng, low_res_scaled_depth = generate_inputs(width, height, args.seed)
+        shape = low_res_scaled_depth.shape
+        print(f"Image: {width}x{height}")
+        compare_blur(generate_image(rng, width, height), args.repeat)
+
+        schedules = [tile_schedule(shape, tile_size) for tile_size in [[4, 4], [8, 8]]]
+        inputs = [
+            (M, N, tiles, tile_depths(rng, M, N, len(tiles)), build_filters(M, N))
+            for M, N, tiles in schedules
+        ]
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            statistics = tile_statistics(low_res_scaled_depth, schedules)
+            results = [
+                blend_tiles(shape, M, N, tiles, depths, filters, statistics[i])
+                for i, (M, N, tiles, depths, filters) in enumerate(inputs)
+            ]
+        current_time = (time.perf_counter() - start) / args.repeat
+        tile_count = sum(len(tiles) for _, _, tiles in schedules)
+        print(f"  current   {current_time:.3f}s for {tile_count} tiles")
+
+        if args.skip_reference:
+            continue
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            expected = [
+                reference_blend(
+                    shape,
+                    M,
+                    N,
+                    tiles,
+                    depths,
+                    {k: v.astype(np.float64) for k, v in filters.items()},
+                    low_res_scaled_depth,
+                )
+                for M, N, tiles, depths, filters in inputs
+            ]
+        reference_time = (time.perf_counter() - start) / args.repeat
+
+        # the current version works in float32, so it can't be exactly the same. the
+        # difference is given relative to the full 16 bit range of the depth
+        difference = max(
+            np.abs(actual - wanted).max() / 2**16
+            for actual, wanted in zip(results, expected)
+        )
+        print(
+            f"  reference {reference_time:.3f}s, "
+            f"speedup {reference_time / current_time:.2f}x, "
+            f"max difference {difference:.2e}"
+        )
+
+
+if __name__ == "__main__":
+    main()
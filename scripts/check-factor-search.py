@@ -0,0 +1,102 @@
+import os
+import sys
+import math
+import argparse
+from PIL import Image
+
+# makes the autovrai package importable when running this from the scripts directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import autovrai
+from autovrai import process
+
+# the memory the pretend model needs at a factor of 1.0, in GB
+FULL_SIZE = 10.0
+
+
+def simulate(threshold, attempted):
+    # a pretend model that runs out of memory above `threshold`. like the real errors,
+    # the attempted amount is only the one allocation that failed, not the whole rest
+    # of what the model still needed
+    capacity = FULL_SIZE * threshold**2
+    tried = []
+
+    def model_loader(config, width, height, factor):
+        return factor
+
+    def model_infer(factor, batch):
+        tried.append(factor)
+        if FULL_SIZE * factor**2 > capacity + 1e-9:
+            raise RuntimeError("CUDA out of memory")
+        return [None for _ in batch]
+
+    autovrai.model_loader = model_loader
+    autovrai.model_infer = model_infer
+    autovrai.cleanup = lambda: None
+    autovrai.parse_memory_error = lambda message: {
+        "allocated": capacity - attempted,
+        "attempted": attempted,
+        "free": attempted / 2,
+    }
+
+    config = {
+        "precision-mode": "dynamic",
+        "precision-factor": 1.0,
+        "batch-size": 1,
+    }
+    precision = process.determine_precision_info(config)
+    factors = {}
+    image = Image.new("RGB", (64, 64))
+    process.generate_depths(config, None, [image], precision, factors, {}, ["image"])
+
+    return factors[str(image.size)], len(tried) - 1
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Check how many probes the dynamic precision search needs to find the "
+            "factor that fits, using a pretend model that runs out of memory above a "
+            "given factor."
+        )
+    )
+    parser.add_argument(
+        "--thresholds",
+        nargs="+",
+        type=float,
+        default=[0.1, 0.3, 0.55, 0.75, 0.9, 0.95],
+        help="Default: 0.1 0.3 0.55 0.75 0.9 0.95",
+    )
+    parser.add_argument(
+        "--attempted",
+        type=float,
+        default=0.02,
+        help="The attempted amount in each memory error (in GB). Default: 0.02",
+    )
+    parser.add_argument(
+        "--max-probes",
+        type=int,
+        default=7,
+        help="Fail if any search needs more probes than this. Default: 7",
+    )
+    args = parser.parse_args()
+
+    failed = False
+    with autovrai.suppress_output():
+        results = [(t, *simulate(t, args.attempted)) for t in args.thresholds]
+
+    for threshold, factor, probes in results:
+        step = process.FACTOR_STEP
+        expected = round(math.floor(threshold / step + 1e-9) * step, 2)
+        ok = factor == expected and probes <= args.max_probes
+        failed = failed or not ok
+        print(
+            f"threshold {threshold:.2f}: settled on {factor:.2f} "
+            f"after {probes} probes{'' if ok else '  <-- FAILED'}"
+        )
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import os
+import sys
+import argparse
+import numpy as np
+from PIL import Image
+
+# makes the autovrai package importable when running this from the scripts directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import autovrai
+
+
+def compare(reference, depth, image, intensity):
+    # the relative error of the depth itself, and how much of the actual stereo output
+    # ends up being different, which is the part that matters in the end
+    relative = np.abs(depth - reference) / np.maximum(np.abs(reference), 1e-6)
+
+    left, right = autovrai.stereo_eyes(image, reference, intensity)
+    expected = left.base.astype(np.int16)
+    left, right = autovrai.stereo_eyes(image, depth, intensity)
+    actual = left.base.astype(np.int16)
+
+    return {
+        "mean relative": relative.mean(),
+        "max relative": relative.max(),
+        "stereo pixels changed": (expected != actual).any(axis=2).mean(),
+        "stereo mean abs": np.abs(expected - actual).mean(),
+    }
+
+
+def main(args):
+    filenames = autovrai.find_filenames(args.input, args.patterns)
+    if not filenames:
+        print(f"No images found in {args.input}")
+        sys.exit(1)
+
+    config = {
+        "model-name": args.model_name,
+        "device-name": args.device_name,
+        "model-directory": args.model_directory,
+    }
+
+    results = {dtype: [] for dtype in args.dtypes}
+    for filename in filenames:
+        image = Image.open(filename).convert("RGB")
+        width = image.width
+        height = image.height
+
+        # switching the dtype doesn't reload the model, so this is cheap to go back and
+        # forth on for each image
+        model = autovrai.model_loader(
+            {**config, "model-dtype": "fp32"}, width, height, args.precision_factor
+        )
+        reference = autovrai.model_infer(model, [image])[0]
+
+        for dtype in args.dtypes:
+            model = autovrai.model_loader(
+                {**config, "model-dtype": dtype}, width, height, args.precision_factor
+            )
+            depth = autovrai.model_infer(model, [image])[0]
+            results[dtype].append(compare(reference, depth, image, args.intensity))
+
+    autovrai.model_unloader(model)
+
+    failed = False
+    print(f"Compared against fp32 on {len(filenames)} images:")
+    for dtype, metrics in results.items():
+        summary = {k: np.mean([m[k] for m in metrics]) for k in metrics[0]}
+        passed = summary["mean relative"] <= args.tolerance
+        failed = failed or not passed
+        print(
+            f"{dtype:>5}: "
+            + ", ".join(f"{k} {v:.4f}" for k, v in summary.items())
+            + f" - {'ok' if passed else 'OVER TOLERANCE'}"
+        )
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compares the depth (and the stereo output made from it) of the "
+        "reduced model-dtype options against fp32 on a directory of images."
+    )
+    parser.add_argument("--input", default="input", help="Default: input")
+    parser.add_argument("--patterns", nargs="+", default=["*.jpg", "*.jpeg", "*.png"])
+    parser.add_argument("--model-name", default="zoedepth_nk")
+    parser.add_argument("--device-name", default="cuda")
+    parser.add_argument("--model-directory", default=os.path.join("cache", "models"))
+    parser.add_argument("--dtypes", nargs="+", default=["fp16", "bf16"])
+    parser.add_argument("--precision-factor", type=float, default=1.0)
+    parser.add_argument("--intensity", type=float, default=1.25, help="Default: 1.25")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.01,
+        help="The highest mean relative depth error that still passes. Default: 0.01",
+    )
+
+    main(parser.parse_args())
@@ -0,0 +1,63 @@
+import os
+import sys
+import argparse
+
+# makes the autovrai package importable when running this from the scripts directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import autovrai
+
+
+# the names as they are registered, which is how torch hub knows them
+MODELS = ["ZoeD_NK", "ZoeD_N", "ZoeD_K"]
+
+
+def main(args):
+    for model_name in args.models:
+        config = {
+            "model-name": model_name,
+            "model-directory": args.model_directory,
+            "device-name": "cpu",
+        }
+
+        if args.verify:
+            valid = autovrai.verify_registered_model(config, model_name)
+            print(f"{model_name}: {'ok' if valid else 'MISSING OR INVALID'}")
+            if not valid:
+                sys.exit(1)
+            continue
+
+        # loading the model the normal way registers it if it isn't already, the size
+        # here doesn't matter since only the resizer depends on it
+        model = autovrai.model_loader(config, 512, 384, 1.0)
+        autovrai.model_unloader(model)
+
+        valid = autovrai.verify_registered_model(config, model_name)
+        print(f"{model_name}: {'ok' if valid else 'MISSING OR INVALID'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Prepares the local model registry, so the models can be loaded "
+        "without a network connection. Run this on a machine with network access and "
+        "copy the model directory over to the machines that don't have it."
+    )
+    parser.add_argument(
+        "--model-directory",
+        default=os.path.join("cache", "models"),
+        help="Directory of the model registry, same as the model-directory option.",
+    )
+    parser.add_argument(
+        "--models",
+        nargs="+",
+        default=["ZoeD_NK"],
+        choices=MODELS,
+        help="The models to prepare or verify.",
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Only check the registered weights against their recorded checksums.",
+    )
+
+    main(parser.parse_args())
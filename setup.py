@@ -15,6 +15,7 @@ setup(
     install_requires=[
         # let me know if i've missed anything
         "gradio",
+        "imageio-ffmpeg",
         "jsonschema",
         "matplotlib",
         "numba",